@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the interpolation kernels of the engine on a synthetic chunk
+
+Compares per chunk size:
+- interpolate: the original dataframe-based function (float64, float16 result, written back into the dataframe),
+  followed by the float32 cast that the /data endpoint used to apply
+- interpolate_model: same math on a ChunkModel (float64, float16 result)
+- interpolate_fused: fused float32 kernel on float16 Psi (as stored in the chunks) and on float32 Psi
+
+Reports the time per datapoint and the peak memory allocated during one call (numpy allocations are traced by tracemalloc)
+
+Run from this directory:
+python benchmark_interpolation.py [--points 1000 10000 100000] [--modes 36]
+"""
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "interpolation-engine", "src"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "interpolation-engine", "test"))
+from utils import interpolation, chunk_model
+from chunk_fixtures import generate_chunk
+
+
+def kernels(df, A, WDref, wd, ws):
+    """
+    :return: dict from kernel name to a function that runs one interpolation of the chunk
+    """
+    model = chunk_model.from_df(df)
+    model_float32 = chunk_model.ChunkModel(model.lat, model.lon, model.z, model.means, model.Psi.astype("float32"))
+
+    def original():
+        frame = df.copy(deep=False)
+        interpolation.interpolate(frame, A, WDref, wd, ws)
+        return [frame[c].to_numpy(dtype="float32") for c in ["u", "v", "w"]]
+
+    def fused(model):
+        return lambda: interpolation.interpolate_fused(model, interpolation.interpolate_coefficients(A, WDref, wd), ws)
+
+    return {
+        "interpolate (dataframe)": original,
+        "interpolate_model": lambda: interpolation.interpolate_model(model, A, WDref, wd, ws),
+        "interpolate_fused float16 Psi": fused(model),
+        "interpolate_fused float32 Psi": fused(model_float32),
+    }
+
+
+def peak_allocation(function):
+    """
+    :return: peak memory in bytes allocated during one call of the function
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the interpolation kernels")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modes", type=int, default=36)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    A = rng.normal(0, 10, (args.modes, args.modes))
+    WDref = np.sort(rng.uniform(0, 360, args.modes))
+    print(f"{'points':>8} {'kernel':<32} {'ns/point':>10} {'peak alloc':>12} {'bytes/point':>12}")
+    for n_points in args.points:
+        df = generate_chunk(n_points, np.linspace(0, 360, args.modes, endpoint=False))
+        for name, function in kernels(df, A, WDref, 123.4, 1.74).items():
+            repeats = max(3, 200000 // n_points)
+            seconds = min(timeit.repeat(function, number=repeats, repeat=3)) / repeats
+            peak = peak_allocation(function)
+            print(f"{n_points:>8} {name:<32} {seconds / n_points * 1e9:>10.1f} {peak:>12} {peak / n_points:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
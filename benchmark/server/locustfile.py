@@ -138,12 +138,16 @@ class User(FastHttpUser):
         self.last_sensor = covering["properties"]["sensor_data"]
         cells = list(map(lambda x: x["properties"]["cell"], covering["features"]))
 
+        if self.BATCH:
+            params = {"ws": ws, "wd": wd, "cells": cells}
+            res = self.client.get(f"/data/batch/{res}/3d", params=params, name="/data/batch")
+            total_size.add(len(res.content))
+        else:
+            pool = Pool()
+            for cell in cells:
+                pool.spawn(self.query_cell, total_size, cell, res, ws, wd, altitude)
 
-        pool = Pool()
-        for cell in cells:
-            pool.spawn(self.query_cell, total_size, cell, res, ws, wd, altitude)
-
-        pool.join()
+            pool.join()
 
         agg_request_meta["response_time"] = (time.perf_counter() - start) * 1000
         agg_request_meta["response_length"] = total_size.get_value()
@@ -155,6 +159,7 @@ class User(FastHttpUser):
     SHIFTING = 1
     STATIC = 2
     TASK = RANDOM
+    BATCH = False #query all cells of a view with a single request to /data/batch instead of one request per cell
     @task
     def do_task(self):
         if self.TASK == self.RANDOM:
@@ -3,9 +3,12 @@ from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
 import sensor_daemon
+import rewarming
+import manifest_daemon
 from covering import app as covering_router
 from data import app as data_router
 from info import app as info_router
+from stream import app as stream_router
 from utils import db_connector
 
 
@@ -15,7 +18,8 @@ middleware = [
         allow_origins=['*'],
         allow_credentials=True,
         allow_methods=['*'],
-        allow_headers=['*']
+        allow_headers=['*'],
+        expose_headers=['X-Sensor-Data', 'ETag']
     )
 ]
 
@@ -29,12 +33,17 @@ app = FastAPI(
 app.include_router(covering_router, prefix="/covering")
 app.include_router(data_router, prefix="/data")
 app.include_router(info_router, prefix="/info")
+app.include_router(stream_router, prefix="/stream")
 
 
 @app.on_event("startup")
 async def startup_event():
     #Start background thread for querying sensor data
     sensor_daemon.start_sensor_db_daemon()
+    #Re-interpolate hot chunks in the background whenever the sensor reading changes
+    rewarming.start_rewarming()
+    #Load the model manifest and the metadata of all resolutions, then poll the manifest for model rollouts
+    await manifest_daemon.start_manifest_daemon()
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -4,20 +4,35 @@ if s2mock:
     from utils import s2mock as s2 #s2mock exists for testing on systems where s2geometry doesnt compile
 else:
     from utils import s2 as s2
+import asyncio
+import json
+from typing import Literal, Optional
+
+import numpy as np
 from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import Response
 from starlette import status
-from sensor_daemon import get_sensor_info
+from sensor_daemon import get_sensor_info, default_sensor
+from data import schedule_prefetch, get_cell_index, pyramid_resolutions, chunk_points
 from models import InputPolygonFeature, Covering
 
 app = APIRouter()
+#media type of the packed binary cell id list
+cell_ids_media_type = "application/x-s2-cell-ids"
+#default budgets of distance-adaptive coverings, unlimited if not set
+max_cells_default = int(os.getenv("COVERING_MAX_CELLS")) if os.getenv("COVERING_MAX_CELLS") else None
+max_points_default = int(os.getenv("COVERING_MAX_POINTS")) if os.getenv("COVERING_MAX_POINTS") else None
 
 
 @app.post("/", response_model=Covering, responses={400: {"detail": "Invalid args or body"}})
 async def covering(request : Request,
                     poly : InputPolygonFeature,
-                   response : Response,
-                   resolution : int = Query(..., description="Resolution for which to compute the covering", gt=0)):
+                   resolution : int = Query(..., description="Resolution for which to compute the covering", gt=0),
+                   format : Literal["geojson", "ids", "binary"] = Query("geojson", description="Response format (geojson, ids or binary), see below"),
+                   camera_lon : Optional[float] = Query(None, description="Longitude of the camera position on the ground (or of the middle of the near edge of the view). Enables the distance-adaptive covering", ge=-180, le=180),
+                   camera_lat : Optional[float] = Query(None, description="Latitude of the camera position, see camera_lon", ge=-90, le=90),
+                   max_cells : Optional[int] = Query(max_cells_default, description="Maximum number of cells of a distance-adaptive covering", gt=0),
+                   max_points : Optional[int] = Query(None, description="Maximum number of datapoints of a distance-adaptive covering (estimated from the mean chunk size). Defaults to COVERING_MAX_POINTS", gt=0)):
     """
     Computes the S2 covering of a given input polygon
     The S2 cell level is fixed and depends on the given resolution
@@ -40,19 +55,75 @@ async def covering(request : Request,
     The response will be a GeoJSON feature collection, describing all S2 cells in the covering with their cell id's as well as their
     respective boundaries
 
+    Cells without any data (e.g. over water or outside of the simulated area) are left out
+
     The cell id's can then be used to query their data points using the /data endpoint
 
+
+    With camera_lon and camera_lat, the covering is distance-adaptive: cells near the camera have the given resolution,
+    farther cells are taken from coarser resolutions of the model (one resolution coarser with every doubling of the distance).
+    The covering then stays within max_cells and max_points, by coarsening all cells and finally leaving out the farthest ones.
+    The number of datapoints is estimated from the mean chunk size of each resolution (from the model manifest or from the
+    chunks loaded so far). Without any estimate, an explicit max_points is rejected with 422, while the configured default
+    is not enforced and the response carries a Warning header
+    Each cell must be queried from /data with its own resolution:
+    - geojson: properties.resolution of each feature
+    - ids: additional list "resolutions", in the same order as the cells
+    - binary: the resolution follows from the level of the cell id
+
+
+    Clients that derive the cell bounds themselves can request a compact response without any geometry through the format parameter:
+    - ids: JSON object {"properties": {"sensor_data": ...}, "cells": [...]} with the cell id's as strings (same as in the GeoJSON)
+    - binary: packed little-endian uint64 cell id's (application/x-s2-cell-ids), the sensor data is sent as JSON in the X-Sensor-Data header
+
     """
-    response.headers["Cache-Control"] = "no-store"
     try:
-        sensor = "EN"
+        sensor = default_sensor
         if poly.properties is not None and poly.properties.sensor_data is not None:
             sensor_data = get_sensor_info(sensor, poly.properties.sensor_data, request.client)
         else:
             sensor_data = get_sensor_info(sensor)
 
-        covering = s2.compute_covering(poly, resolution, sensor_data)
+        adaptive = camera_lon is not None or camera_lat is not None
+        if adaptive and (camera_lon is None or camera_lat is None):
+            raise ValueError("camera_lon and camera_lat are required together")
+        headers = {"Cache-Control": "no-store"}
+        #cells without a chunk are left out of the covering
+        if adaptive:
+            resolutions = pyramid_resolutions(resolution)
+            indexes = dict(zip(resolutions, await asyncio.gather(*[get_cell_index(r) for r in resolutions])))
+            points_per_cell = chunk_points(resolutions)
+            if max_points is not None and points_per_cell is None:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="max_points cannot be enforced, the chunk size is unknown")
+            if max_points is None and max_points_default is not None:
+                if points_per_cell is None:
+                    headers["Warning"] = '199 - "COVERING_MAX_POINTS not enforced, the chunk size is unknown"'
+                else:
+                    max_points = max_points_default
+            cells = s2.compute_adaptive_covering_ids(poly, resolution, (camera_lon, camera_lat), indexes,
+                                                     max_cells, max_points, points_per_cell)
+        else:
+            index = await get_cell_index(resolution)
+            cells = [(cell, resolution) for cell in s2.compute_covering_ids(poly, resolution, index)]
+        if format == "geojson":
+            covering = s2.cells_to_covering([cell for cell, _ in cells], sensor_data)
     except (ValueError, KeyError) as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid args or body")
 
-    return covering
+    #the client will request all cells from /data next ==> start loading their chunks already
+    for cell_resolution in sorted({cell_resolution for _, cell_resolution in cells}):
+        schedule_prefetch([cell for cell, r in cells if r == cell_resolution], cell_resolution)
+
+    sensor_json = sensor_data.model_dump_json() if sensor_data is not None else "null"
+    if format == "ids":
+        content = '{"properties":{"sensor_data":' + sensor_json + '},"cells":' + json.dumps([str(cell) for cell, _ in cells])
+        if adaptive:
+            content = content + ',"resolutions":' + json.dumps([cell_resolution for _, cell_resolution in cells])
+        return Response(content=content + '}', media_type="application/json", headers=headers)
+    if format == "binary":
+        headers["X-Sensor-Data"] = sensor_json
+        content = np.array([cell for cell, _ in cells], dtype="<u8").tobytes()
+        return Response(content=content, media_type=cell_ids_media_type, headers=headers)
+
+    #serialize directly, returning the model would make FastAPI validate the whole feature collection again
+    return Response(content=covering.model_dump_json(), media_type="application/json", headers=headers)
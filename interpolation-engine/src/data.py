@@ -1,79 +1,714 @@
-from typing import Optional
+import asyncio
+import hashlib
+import os
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Literal, Optional
 
-import pandas
-from utils import interpolation
-from fastapi import APIRouter, Response, Path, Query, HTTPException
+import numpy as np
+from utils import interpolation, chunk_model, cell_index
+from utils.manifest import Manifest
+from utils.cache import SizedCache
+from utils.singleflight import SingleFlight
+from fastapi import APIRouter, Response, Path, Query, Header, HTTPException
 from starlette import status
-from utils.serializers import df_to_parquet
+from utils import serializers
+from models import Precision
 from utils.db_connector import query_df_from_sql
-from utils.gcs_connector import retrieve_df, retrieve_pickle
+from utils.gcs_connector import retrieve_model, retrieve_pickle, retrieve_cell_index, run_io
 from async_lru import alru_cache
-pandas.options.mode.chained_assignment = None
 
 
 app = APIRouter()
 
+#version of the deployed POD model, part of all cache keys so that a model rollout never serves stale chunks
+#both are replaced together by swap_manifest when a new model is rolled out (see manifest_daemon)
+model_version = os.getenv("MODEL_VERSION", "0")
+manifest = Manifest(model_version, {})
+#decoded chunk models, bounded by their size in memory
+chunk_cache = SizedCache(int(os.getenv("CHUNK_CACHE_BYTES", 512 * 1024 * 1024)), lambda model: model.nbytes)
+#interpolated wind components per chunk and wind direction at a wind speed of 1 m/s (see interpolation.ScalableResult)
+# ==> a new wind speed at the same direction only scales the cached field
+result_cache = SizedCache(int(os.getenv("RESULT_CACHE_BYTES", 256 * 1024 * 1024)), lambda result: result.nbytes)
+#result cache hits for the same wind speed as the previous hit (exact) and for another wind speed at the same direction (rescaled)
+result_hits = Counter()
+#pre-encoded static columns of the responses (lat, lon, z and cell id), which never change for a chunk
+static_column_cache = SizedCache(int(os.getenv("STATIC_COLUMN_CACHE_BYTES", 128 * 1024 * 1024)), serializers.encoded_size)
+#if set, the wind fields at all reference directions are precomputed when a chunk is loaded
+# ==> each request is a blend of two precomputed fields instead of a product with Psi
+precomputed_basis = os.getenv("PRECOMPUTED_BASIS") == "True"
+#if set, float16 Psi is converted to float32 when a chunk is loaded
+# ==> doubles the memory of the cached chunks, but the interpolation is a single float32 matrix-vector product
+float32_psi = os.getenv("FLOAT32_PSI") == "True"
+#share of the energy of the POD modes that may be discarded when serving, for all resolutions ("0.001") or per
+#resolution ("4:0.001,32:0.01") ==> chunks are loaded and interpolated with only the top-k modes (see serving_modes)
+mode_error_budgets = interpolation.parse_error_budgets(os.getenv("MODE_ERROR_BUDGET", "0"))
+max_batch_cells = 256
+#if set, /covering warms the chunk cache with the chunks of the returned cells in the background
+prefetch_on_covering = os.getenv("PREFETCH_ON_COVERING", "True") == "True"
+prefetch_semaphore = asyncio.Semaphore(int(os.getenv("PREFETCH_CONCURRENCY", 8)))
+max_pending_prefetches = 1024
+pending_prefetches = set() #cache keys of the chunks that are currently prefetched, to avoid duplicate prefetches
+prefetch_tasks = set() #strong references to the running prefetch tasks, so they are not garbage collected
+request_counts = Counter() #number of requests per (cell, resolution), to find the hot chunks
+#number of loaded chunks and their datapoints per resolution, to estimate the chunk size of resolutions without
+#points in the manifest (see chunk_points)
+loaded_chunks = Counter()
+loaded_points = Counter()
+live_requests = 0 #number of /data requests that are currently processed
+chunk_flights = SingleFlight() #coalesces concurrent loads of the same chunk model
+data_flights = SingleFlight() #coalesces concurrent identical /data requests
+format_description = "Response encoding (parquet, arrow or raw). Takes precedence over the Accept header. Defaults to parquet"
+precision_description = "Bits per value of u, v and w (32 or 16)"
+modes_description = ("Number of POD modes to interpolate with (the modes with the most energy first), capped at the modes "
+                     "served for the resolution. Fewer modes are faster but less accurate. Defaults to all served modes. "
+                     "Ignored if the engine precomputes the wind fields of the chunks (PRECOMPUTED_BASIS), which always "
+                     "use all served modes")
+altitude_description = "Only return the datapoints at this altitude (z in meters above sea level). Defaults to all altitudes"
+max_altitude_description = "If given, all datapoints from altitude up to this altitude are returned"
+cache_headers = {'Cache-Control': 'public, max-age=300', "Vary": "Accept"}
+
+@app.get("/batch/{resolution}/3d")
+async def data_batch(resolution : int = Path(..., description="Resolution factor for which to load the data. You NEED to use the same as for the /covering endpoint. The cell ids depend on it", gt=0),
+                     cells : List[int] = Query(..., description="S2 cell ids received from /covering", min_length=1, max_length=max_batch_cells),
+                     ws : float = Query(..., description="wind speed in m/s, as received from /covering", ge=0),
+                     wd : float = Query(..., description="Wind direction in degrees as received from /covering", ge=0, lt=360),
+                     format : Optional[Literal["parquet", "arrow", "raw"]] = Query(None, description=format_description),
+                     precision : Precision = Query(Precision.single, description=precision_description),
+                     modes : Optional[int] = Query(None, description=modes_description, ge=1),
+                     altitude : Optional[float] = Query(None, description=altitude_description),
+                     max_altitude : Optional[float] = Query(None, description=max_altitude_description),
+                     accept : Optional[str] = Header(None),
+                     if_none_match : Optional[str] = Header(None)):
+    """
+    Generates and returns the wind data for multiple cells of the same resolution in a single response
+
+    Same as the per-cell endpoint, but the POD coefficients are only interpolated once for all chunks of the request and
+    the chunks that are not cached yet are computed with a single stacked matrix product
+
+
+    Response encodes a table with the schema [cell, lat, lon, z, u, v, w], encodings are the same as for the per-cell endpoint
+
+    Each requested cell is its own row group (parquet), record batch (arrow) or message (raw), in the order of the request. Non-existent chunks are left out
+
+    Prefer the per-cell endpoint if the responses should be cached by the browser individually
+    """
+    cells = list(dict.fromkeys(cells))
+    modes = parse_modes(modes)
+    encoding = serializers.negotiate_encoding(format, accept)
+    altitudes = altitude_range(altitude, max_altitude)
+    etag = make_etag(("batch", tuple(cells), resolution, model_version, ws, wd, encoding, precision, modes,
+                      error_budget(resolution), altitudes))
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+
+    with live_request():
+        A, WDref = await query_additional_data(resolution)
+        if A is None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid resolution")
+
+        request_counts.update((cell, resolution) for cell in cells)
+        models = await asyncio.gather(*[get_chunk_model(cell, resolution, A) for cell in cells])
+        models = [(cell, model) for cell, model in zip(cells, models) if model is not None]
+
+        #only interpolate the chunks whose results are not cached yet for this wind direction
+        modes = request_modes(resolution, A, modes)
+        keys = {cell: result_key(cell, resolution, wd, modes, altitudes) for cell, _ in models}
+        rows = {cell: chunk_rows(model, altitudes) for cell, model in models}
+        results = {cell: result_cache.get(keys[cell][0]) for cell, _ in models}
+        missing = [(cell, model if keys[cell][1] else chunk_model.select_rows(model, rows[cell]))
+                   for cell, model in models if results[cell] is None]
+        if precomputed_basis:
+            computed = [interpolation.interpolate_basis(model, WDref, wd, 1.0, compression_type="float32") for _, model in missing]
+        else:
+            AInterp = interpolation.interpolate_coefficients(A[:modes], WDref, wd)
+            computed = interpolation.interpolate_fused_models([model for _, model in missing], AInterp, 1.0)
+        for (cell, _), result in zip(missing, computed):
+            results[cell] = interpolation.ScalableResult(*result)
+            result_cache.put(keys[cell][0], results[cell])
+
+        missing = {cell for cell, _ in missing}
+        chunks = []
+        for cell, model in models:
+            components = scale_result(results[cell], ws, cell in missing)
+            chunks.append((cell, model, *select_components(components, rows[cell] if keys[cell][1] else None)))
+        if not chunks:
+            chunks = [(0, None, None, None, None)]
+        content = encode_chunks(chunks, resolution, precision, encoding, with_cell=True, altitudes=altitudes)
+        return to_response(content, encoding, etag)
+
+
 @app.get("/{cell}/{resolution}/3d")
 async def data(cell : int = Path(..., description="S2 cell id received from /covering", ge=0),
                resolution : int = Path(..., description="Resolution factor for which to load the data. You NEED to use the same as for the /covering endpoint. The cell id depends on it", gt=0),
                ws : float = Query(..., description="wind speed in m/s, as received from /covering", ge=0),
                wd : float = Query(..., description="Wind direction in degrees as received from /covering", ge=0, lt=360),
-               gcs: Optional[int] = Query(0, description="Ignore this. Only exists for legacy support")):
+               gcs: Optional[int] = Query(0, description="Ignore this. Only exists for legacy support"),
+               format : Optional[Literal["parquet", "arrow", "raw"]] = Query(None, description=format_description),
+               precision : Precision = Query(Precision.single, description=precision_description),
+               modes : Optional[int] = Query(None, description=modes_description, ge=1),
+               altitude : Optional[float] = Query(None, description=altitude_description),
+               max_altitude : Optional[float] = Query(None, description=max_altitude_description),
+               accept : Optional[str] = Header(None),
+               if_none_match : Optional[str] = Header(None)):
     """
     Generates and returns the wind data for a given cell at a given resolution, for given wind speed and direction through on POD interpolation
 
 
-    Response is a binary parquet file, which encodes a dataframe with the schema [lat, lon, z, u, v, w]
+    Response encodes a table with the schema [lat, lon, z, u, v, w]
+
+    The encoding is chosen through the format parameter or the Accept header:
+    - application/vnd.apache.parquet: binary parquet file (default)
+    - application/vnd.apache.arrow.stream: Arrow IPC stream
+    - application/x-wind-columns: raw little-endian columns with a small header (see utils.serializers.frames_to_raw)
+
+    lat and lon are float32, z is int32, u, v and w are float32 or float16 depending on the precision parameter
 
     Lat and lon are latitude and longitude
 
     z is the elevation in meters above sea level
 
     u,v and w encode the wind vector with respect to the UTM coordinate system
+
+    Only the leading POD modes within the error budget of the resolution are served (MODE_ERROR_BUDGET, all modes by
+    default). The modes parameter reduces them further for clients that need less accuracy
+
+    With the altitude parameter (and max_altitude for a range), only the datapoints at those altitudes are interpolated
+    and returned
+
+    Responses carry a weak ETag. Requests with a matching If-None-Match header are answered with 304 Not Modified
+    without loading or interpolating the chunk
+    """
+    modes = parse_modes(modes)
+    encoding = serializers.negotiate_encoding(format, accept)
+    altitudes = altitude_range(altitude, max_altitude)
+    key = (cell, resolution, model_version, ws, wd, encoding, precision, modes, error_budget(resolution), altitudes)
+    etag = make_etag(key)
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+
+    with live_request():
+        request_counts[(cell, resolution)] += 1
+        #concurrent identical requests (e.g. right after a sensor update) share a single computation
+        content = await data_flights.do(key, compute_data, cell, resolution, ws, wd, encoding, precision, modes, altitudes)
+        return to_response(content, encoding, etag)
+
+
+async def compute_data(cell, resolution, ws, wd, encoding, precision, modes, altitudes):
     """
-    add_data_future = query_additional_data(resolution)
-    df = retrieve_df(cell, resolution, -1)
-    if df is not None:
-        A, WDref = await add_data_future
-        interpolation.interpolate(df, A, WDref, wd, ws)
+    Helper function to compute the encoded response body of the per-cell /data endpoint
+    :param modes: number of POD modes requested by the client, or None
+    :param altitudes: requested altitude range, or None for all altitudes
+    :return: response body as bytes
+    """
+    A, WDref = await query_additional_data(resolution)
+    model = await get_chunk_model(cell, resolution, A)
+    if model is not None:
+        u, v, w = get_result(cell, resolution, model, A, WDref, ws, wd, request_modes(resolution, A, modes), altitudes)
     else:
-        A, WDref = await add_data_future
         if A is None:
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid resolution")
         else:
             # if non-existend chunk was queried, we return an empty frame instead of a 404 error
-            df = pandas.DataFrame(columns=['lat','lon','z','u','v','w'])
-
-    #correct the response schema
-    #TODO May change u,v,w to float16 if ever supported by frontend
-    df = df[["lat", "lon", "z", "u", "v", "w"]]
-    df["lat"] = df["lat"].astype("float32")
-    df["lon"] = df["lon"].astype("float32")
-    df["z"] = df["z"].astype("int32")
-    df["u"] = df["u"].astype("float32")
-    df["v"] = df["v"].astype("float32")
-    df["w"] = df["w"].astype("float32")
-    result = df_to_parquet(df)
+            u, v, w = None, None, None
+    return encode_chunks([(cell, model, u, v, w)], resolution, precision, encoding, altitudes=altitudes)
+
+
+@contextmanager
+def live_request():
+    """
+    Helper context manager to count the /data requests that are currently processed, so that background work can yield to them
+    """
+    global live_requests
+    live_requests = live_requests + 1
+    try:
+        yield
+    finally:
+        live_requests = live_requests - 1
+
+
+async def get_chunk_model(cell, resolution, A):
+    """
+    Helper function to get the decoded chunk model for a given cell and resolution
+    Decoded models are kept in the chunk cache, so repeated requests for the same chunk skip the download and decoding
+    Download and decoding run in the storage thread pool, so the event loop stays free for other requests
+    :param A: A matrix of the resolution, needed to precompute the basis in precomputed-basis mode
+    :return: ChunkModel, or None if the chunk does not exist
+    :raises HTTPException: 503 if the storage did not respond in time
+    """
+    if A is None:
+        return None
+    key = (cell, resolution, model_version)
+    model = chunk_cache.get(key)
+    if model is None:
+        #cells without a chunk are answered from the cell index, without a storage round trip
+        index = await get_cell_index(resolution)
+        if index is not None and not cell_index.contains(index, [cell])[0]:
+            return None
+        #concurrent requests for the same chunk share a single download
+        model = await chunk_flights.do(key, fetch_chunk_model, cell, resolution, A, key)
+    return model
+
+
+async def fetch_chunk_model(cell, resolution, A, key):
+    """
+    Helper function to load a chunk model from storage into the chunk cache
+    :return: ChunkModel, or None if the chunk does not exist
+    """
+    try:
+        model = await run_io(load_chunk_model, cell, resolution, A)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Storage timeout")
+    if model is not None:
+        chunk_cache.put(key, model)
+        loaded_chunks[resolution] += 1
+        loaded_points[resolution] += len(model)
+    return model
+
+
+def schedule_prefetch(cells, resolution):
+    """
+    Schedule background prefetches of the chunk models for the given cells, so that the following /data requests of
+    the client find them in the chunk cache
+    Chunks that are already cached or being prefetched are skipped, and at most <PREFETCH_CONCURRENCY> chunks are loaded at once
+    Must be called from the event loop
+    :param cells: S2 cell ids
+    :param resolution: resolution of the cells
+    """
+    if not prefetch_on_covering:
+        return
+    for cell in cells:
+        key = (cell, resolution, model_version)
+        if key in pending_prefetches or key in chunk_cache or len(pending_prefetches) >= max_pending_prefetches:
+            continue
+        pending_prefetches.add(key)
+        task = asyncio.create_task(prefetch_chunk_model(cell, resolution, key))
+        prefetch_tasks.add(task)
+        task.add_done_callback(prefetch_tasks.discard)
+
+
+async def prefetch_chunk_model(cell, resolution, key):
+    """
+    Helper function to load a chunk model into the chunk cache in the background
+    Prefetching is best-effort, so all errors are ignored
+    """
+    try:
+        async with prefetch_semaphore:
+            A, _ = await query_additional_data(resolution)
+            await get_chunk_model(cell, resolution, A)
+    except Exception as e:
+        pass
+    finally:
+        pending_prefetches.discard(key)
+
+
+def load_chunk_model(cell, resolution, A):
+    """
+    Blocking helper function to download and decode a chunk model
+    Only the modes that are served for the resolution are loaded (see serving_modes)
+    :return: ChunkModel, or None if the chunk does not exist
+    """
+    modes = serving_modes(resolution, A)
+    model = retrieve_model(cell, resolution, modes if modes < len(A) else None)
+    if model is None:
+        return None
+    if precomputed_basis:
+        model = chunk_model.precompute_basis(model, A[:modes])
+    elif float32_psi:
+        model = chunk_model.to_float32(model)
+    return model
+
+
+def get_result(cell, resolution, model, A, WDref, ws, wd, modes, altitudes=None):
+    """
+    Helper function to get the interpolated wind components of a chunk for a sensor reading
+    Results are kept in the result cache per wind direction, so repeated requests for the same direction skip the
+    interpolation and only scale the cached field with the wind speed
+    :param modes: number of POD modes to interpolate with, see request_modes
+    :param altitudes: altitude range to return, or None for the whole chunk
+    :return: u, v and w as float32 numpy arrays
+    """
+    key, whole = result_key(cell, resolution, wd, modes, altitudes)
+    rows = chunk_rows(model, altitudes)
+    result = result_cache.get(key)
+    computed = result is None
+    if computed:
+        result = interpolation.ScalableResult(*interpolate(model if whole else chunk_model.select_rows(model, rows),
+                                                           A[:modes], WDref, wd, 1.0))
+        result_cache.put(key, result)
+    return select_components(scale_result(result, ws, computed), rows if whole else None)
+
+
+def result_key(cell, resolution, wd, modes, altitudes):
+    """
+    Helper function to get the result cache key of a request
+    A cached field of the whole chunk also serves requests for an altitude range. Otherwise only the rows of the range
+    are interpolated and cached under their own key
+    :param altitudes: requested altitude range, or None for the whole chunk
+    :return: cache key, and True if it is the key of the field of the whole chunk
+    """
+    key = (cell, resolution, model_version, wd, modes)
+    if altitudes is None or key in result_cache:
+        return key, True
+    return key + (altitudes,), False
+
+
+def chunk_rows(model, altitudes):
+    """
+    Helper function to find the rows of a chunk in an altitude range
+    :return: slice or numpy array with the row indices (see chunk_model.altitude_rows), or None for all rows
+    """
+    return None if altitudes is None else chunk_model.altitude_rows(model, *altitudes)
+
+
+def select_components(components, rows):
+    """
+    Helper function to select rows of the interpolated wind components of a whole chunk
+    :param rows: row indices, or None to keep all rows
+    :return: u, v and w
+    """
+    if rows is None:
+        return components
+    return tuple(component[rows] for component in components)
+
+
+def altitude_range(altitude, max_altitude):
+    """
+    Helper function to get the altitude range of a request
+    :return: (lowest, highest) altitude, or None for all altitudes
+    :raises HTTPException: 422 if the range is invalid
+    """
+    if altitude is None:
+        if max_altitude is not None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="max_altitude requires altitude")
+        return None
+    if max_altitude is None:
+        return altitude, altitude
+    if max_altitude < altitude:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="max_altitude is below altitude")
+    return altitude, max_altitude
+
+
+def scale_result(result, ws, computed):
+    """
+    Helper function to scale a cached result to a wind speed and count the kind of result cache hit
+    :param computed: True if the result was just interpolated (result cache miss)
+    :return: u, v and w as float32 numpy arrays
+    """
+    scaled, exact = result.scale(ws)
+    if not computed:
+        result_hits["exact" if exact else "rescaled"] += 1
+    return scaled
+
+
+def result_stats():
+    """
+    :return: stats of the result cache, with the hits split into exact and rescaled hits
+    """
+    stats = result_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    for kind in ["exact", "rescaled"]:
+        stats[f"{kind}_hits"] = result_hits[kind]
+        stats[f"{kind}_hit_rate"] = result_hits[kind] / lookups if lookups else 0.0
+    return stats
+
+
+async def warm_result(cell, resolution, ws, wd):
+    """
+    Interpolate a chunk for a sensor reading ahead of time and store the result in the result cache
+    :return: True if the chunk was interpolated, False if the result was cached already or the chunk does not exist
+    """
+    A, WDref = await query_additional_data(resolution)
+    if A is None:
+        return False
+    #warmed for the default number of modes, the one requests without the modes parameter use
+    modes = serving_modes(resolution, A)
+    key = (cell, resolution, model_version, wd, modes)
+    if key in result_cache:
+        return False
+    model = await get_chunk_model(cell, resolution, A)
+    if model is None:
+        return False
+    result_cache.put(key, interpolation.ScalableResult(*interpolate(model, A[:modes], WDref, wd, 1.0)))
+    return True
+
+
+def interpolate(model, A, WDref, wd, ws):
+    """
+    Helper function to interpolate a chunk model, using the precomputed basis if the model has one
+    :param A: A matrix of the resolution, only the modes to interpolate with (the basis always uses the served modes)
+    :return: u, v and w as float32 numpy arrays
+    """
+    if model.basis is not None:
+        return interpolation.interpolate_basis(model, WDref, wd, ws, compression_type="float32")
+    return interpolation.interpolate_fused(model, interpolation.interpolate_coefficients(A, WDref, wd), ws)
+
+def error_budget(resolution):
+    """
+    :return: share of the energy of the POD modes that may be discarded for the resolution (see MODE_ERROR_BUDGET)
+    """
+    return mode_error_budgets.get(resolution, mode_error_budgets.get(None, 0.0))
+
+
+def serving_modes(resolution, A):
+    """
+    Number of leading POD modes that are loaded and served for a resolution, the smallest one that stays within the
+    error budget of the resolution
+    Uses the mode energies recorded in the manifest, or derives them from A for models without them
+    :param A: A matrix of the resolution
+    :return: number of modes k
+    """
+    budget = error_budget(resolution)
+    if budget <= 0:
+        return len(A)
+    energy = manifest.energy(resolution)
+    if energy is None or len(energy) != len(A):
+        energy = interpolation.mode_energy(A)
+    return interpolation.modes_for_budget(energy, budget)
+
+
+def parse_modes(modes):
+    """
+    Helper function to normalise the modes parameter before it becomes part of the ETag and the cache keys
+    The precomputed basis of a chunk always holds the fields of all served modes ==> with PRECOMPUTED_BASIS the
+    parameter is ignored, so that requests with and without it share the same ETag and result cache entries
+    :param modes: number of modes requested by the client, or None
+    :return: modes, or None if it has no effect
+    """
+    return None if precomputed_basis else modes
+
+
+def request_modes(resolution, A, modes):
+    """
+    Number of POD modes to interpolate a request with
+    :param modes: number of modes requested by the client, or None for the default
+    :return: number of modes, at most the number of modes that are loaded for the resolution
+    """
+    served = serving_modes(resolution, A)
+    return served if modes is None else min(modes, served)
 
+
+def to_static_columns(model, cell=None):
+    """
+    Helper function to create the columns of the response that do not depend on the wind reading [lat, lon, z]
+    :param model: ChunkModel of the chunk, or None to create empty columns
+    :param cell: if given, the cell id is added as first column (used for batch responses)
+    :return: dict from column name to numpy array
+    """
+    columns = {}
+    if model is None:
+        columns["lat"], columns["lon"] = np.empty(0, dtype="float32"), np.empty(0, dtype="float32")
+        columns["z"] = np.empty(0, dtype="int32")
+    else:
+        columns["lat"], columns["lon"] = model.lat.astype("float32", copy=False), model.lon.astype("float32", copy=False)
+        columns["z"] = model.z.astype("int32", copy=False)
+    if cell is not None:
+        columns = {"cell": np.full(len(columns["lat"]), cell, dtype="uint64"), **columns}
+    return columns
+
+
+def encode_chunks(chunks, resolution, precision, encoding, with_cell=False, altitudes=None):
+    """
+    Helper function to encode the interpolated chunks with the response schema [lat, lon, z, u, v, w]
+    Parameters are the same as for encode_frames()
+    :return: encoded chunks as bytes
+    """
+    return serializers.encoders[encoding](encode_frames(chunks, resolution, precision, encoding, with_cell, altitudes))
+
+
+def encode_frames(chunks, resolution, precision, encoding, with_cell=False, altitudes=None):
+    """
+    Helper function to create the frames of the interpolated chunks, to be encoded with utils.serializers
+    The pre-encoded static columns of each chunk are reused from the static column cache, so only u, v and w are encoded per request
+    :param chunks: list of (cell, ChunkModel or None for an empty frame, u, v, w)
+    :param precision: bits per value of u, v and w (32 or 16)
+    :param encoding: name of the encoding (see utils.serializers.media_types)
+    :param with_cell: if set, the cell id is added as first column (used for batch responses)
+    :param altitudes: if given, only the coordinates of the rows in this altitude range are encoded. u, v and w must
+    already be restricted to these rows
+    :return: list of frames, one per chunk
+    """
+    wind_type = np.dtype("float16" if precision == Precision.half else "float32")
+    frames = []
+    for cell, model, u, v, w in chunks:
+        #parquet and arrow share the same pre-encoded Arrow arrays
+        key = (cell, resolution, model_version, with_cell, "raw" if encoding == "raw" else "arrow", wind_type.itemsize, altitudes)
+        static = static_column_cache.get(key) if model is not None else None
+        if static is None:
+            coordinates = model
+            if model is not None and altitudes is not None:
+                coordinates = chunk_model.select_rows(model, chunk_rows(model, altitudes), coordinates_only=True)
+            static = serializers.encode_static(encoding, to_static_columns(coordinates, cell if with_cell else None), wind_type)
+            if model is not None:
+                static_column_cache.put(key, static)
+        if model is None:
+            u, v, w = np.empty(0), np.empty(0), np.empty(0)
+        frames.append((static, {"u": u.astype(wind_type), "v": v.astype(wind_type), "w": w.astype(wind_type)}))
+    return frames
+
+
+def to_response(content, encoding, etag):
+    """
+    Helper function to wrap an encoded response body into a cacheable response
+    :return: Response
+    """
     headers = {
         "Content-Disposition": "inline",
-        'Cache-Control': 'public, max-age=300'
+        "ETag": etag,
+        **cache_headers
     }
-    return Response(content=result, headers=headers)
+    return Response(content=content, headers=headers, media_type=serializers.media_types[encoding])
 
 
+def make_etag(key):
+    """
+    Helper function to create a weak ETag for a response
+    The data of a response is determined by the request parameters, the model version and the encoding, so the ETag
+    can be derived from them without computing the body. The bytes are not: the per-cell and the batch endpoint share
+    the result cache but interpolate with different float32 kernels, and PRECOMPUTED_BASIS and FLOAT32_PSI change the
+    rounding as well ==> equal ETags mean equivalent data (within float32 rounding), not equal bytes
+    :param key: tuple with all parameters that determine the response data, including model version and encoding
+    :return: weak ETag
+    """
+    return 'W/"' + hashlib.sha1(repr(key).encode()).hexdigest() + '"'
+
+
+def is_not_modified(if_none_match, etag):
+    """
+    Helper function to evaluate an If-None-Match header (weak comparison, as required for GET requests)
+    :param if_none_match: value of the If-None-Match header, or None
+    :return: True if the client has a current copy of the response
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    opaque = [tag[2:] if tag.startswith("W/") else tag for tag in tags + [etag]]
+    return "*" in tags or opaque[-1] in opaque[:-1]
+
+
+def not_modified(etag):
+    """
+    Helper function to create a 304 response, which repeats the caching headers of the full response
+    :return: Response
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **cache_headers})
+
 
-@alru_cache(maxsize=2*10) #Includes some buffer just because
 async def query_additional_data(resolution):
     """
-    Helper function to query the additional data necessary for applying POD interpolation
-    Applies caching to avoid reloading the data. We do not expect it to change during normal usage
+    Helper function to query the additional data necessary for applying POD interpolation, for the current model version
     :param resolution: the resolution for which to load it
     :return: A and WDref matrix (as a tuple in that order)
     """
-    A = retrieve_pickle(f"metadata/{resolution}_A.pickle")
-    WDref = retrieve_pickle(f"metadata/{resolution}_WDref.pickle")
+    files = manifest.files(resolution)
+    return await load_additional_data(manifest.model_version, files["A"], files["WDref"])
+
+
+@alru_cache(maxsize=2*10) #Includes some buffer just because
+async def load_additional_data(version, A_path, WDref_path):
+    """
+    Helper function to load the additional data necessary for applying POD interpolation
+    Applies caching to avoid reloading the data. It only changes with the model version
+    :param version: model version, only part of the cache key
+    :return: A and WDref matrix (as a tuple in that order)
+    """
+    try:
+        A, WDref = await asyncio.gather(run_io(retrieve_pickle, A_path), run_io(retrieve_pickle, WDref_path))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Storage timeout")
     return A, WDref
 
 
+async def query_cell_index(resolution):
+    """
+    Helper function to query the index of the cells that have a chunk (see utils.cell_index), for the current model version
+    :param resolution: the resolution for which to load it
+    :return: sorted numpy array of uint64 cell ids, or None if there is no index for the resolution
+    """
+    return await load_cell_index(manifest.model_version, manifest.files(resolution)["cells"])
+
+
+@alru_cache(maxsize=2*10)
+async def load_cell_index(version, path):
+    """
+    Helper function to load the index of the cells that have a chunk
+    Cached like the additional data, as it only changes with the model version
+    :param version: model version, only part of the cache key
+    :return: sorted numpy array of uint64 cell ids, or None if there is no index for the resolution
+    """
+    return await run_io(retrieve_cell_index, path)
+
+
+async def get_cell_index(resolution):
+    """
+    Get the cell index of a resolution, see query_cell_index
+    Timeouts are not cached, the next call tries again
+    :return: sorted numpy array of uint64 cell ids, or None if there is no index or it could not be loaded in time
+    """
+    try:
+        return await query_cell_index(resolution)
+    except asyncio.TimeoutError:
+        #without the index all cells are assumed to exist, which is only slower
+        return None
+
+
+def pyramid_resolutions(resolution):
+    """
+    Get the resolutions of the current model from a given resolution up to the coarsest one
+    :return: sorted list of resolutions, starting with the given one
+    """
+    return [resolution] + sorted(r for r in manifest.resolutions if r > resolution)
+
+
+def chunk_points(resolutions):
+    """
+    Estimate the mean number of datapoints per chunk of resolutions
+    The manifest takes precedence, otherwise the mean size of the chunks loaded so far is used. Resolutions without
+    either get the mean estimate of the others, as the cell level is chosen so that the chunk size stays somewhat
+    constant across resolutions
+    :param resolutions: list of resolutions
+    :return: dict from resolution to the estimated number of datapoints, or None if there is no estimate for any of them
+    """
+    points = {}
+    for resolution in resolutions:
+        if manifest.points(resolution) is not None:
+            points[resolution] = manifest.points(resolution)
+        elif loaded_chunks[resolution]:
+            points[resolution] = loaded_points[resolution] / loaded_chunks[resolution]
+    if not points:
+        return None
+    mean = sum(points.values()) / len(points)
+    return {resolution: points.get(resolution, mean) for resolution in resolutions}
+
+
+async def swap_manifest(new_manifest):
+    """
+    Switch to a new model manifest
+    The metadata of all resolutions of the new manifest is loaded before the switch, so that requests never wait for it
+    The switch itself happens without any await in between ==> requests either see the old or the new model version
+    If the model version changed, the cached chunks and results of the old version are dropped
+    :param new_manifest: Manifest
+    """
+    global manifest, model_version
+    loads = []
+    for resolution in new_manifest.resolutions:
+        files = new_manifest.files(resolution)
+        loads.append(load_additional_data(new_manifest.model_version, files["A"], files["WDref"]))
+        loads.append(load_cell_index(new_manifest.model_version, files["cells"]))
+    await asyncio.gather(*loads, return_exceptions=True) #failed loads are retried on request
+
+    old_manifest = manifest
+    manifest, model_version = new_manifest, new_manifest.model_version
+    if old_manifest.model_version != new_manifest.model_version:
+        chunk_cache.clear()
+        result_cache.clear()
+        static_column_cache.clear()
+        loaded_chunks.clear()
+        loaded_points.clear()
+        for resolution in old_manifest.resolutions:
+            files = old_manifest.files(resolution)
+            load_additional_data.cache_invalidate(old_manifest.model_version, files["A"], files["WDref"])
+            load_cell_index.cache_invalidate(old_manifest.model_version, files["cells"])
+
+
 
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-import utils.gcs_connector as gcs_connector
+import data
 
 app = APIRouter()
 
@@ -10,5 +10,27 @@ def get_resolutions():
     """
     Returns list of available resolutions
     """
-    resolutions = sorted(list(set([int(name.split("/")[1].split("_")[0]) for name in gcs_connector.list_dir("metadata")])))
-    return resolutions
\ No newline at end of file
+    return sorted(data.manifest.resolutions.keys())
+
+
+@app.get("/manifest")
+def get_manifest():
+    """
+    Returns the manifest of the deployed model: model version, and per resolution the number of chunks and the locations of the metadata files
+    Chunk counts are null if the bucket has no manifest file
+    """
+    return data.manifest.to_dict()
+
+
+@app.get("/cache")
+def get_cache_stats():
+    """
+    Returns hit/miss/eviction counters and occupancy of the in-memory caches of this instance
+    """
+    return {
+        "chunk_models": data.chunk_cache.stats(),
+        "results": data.result_stats(),
+        "static_columns": data.static_column_cache.stats(),
+        "coalesced_chunk_loads": data.chunk_flights.stats(),
+        "coalesced_requests": data.data_flights.stats()
+    }
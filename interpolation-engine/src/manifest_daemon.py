@@ -0,0 +1,60 @@
+"""
+Offers background daemon that polls the model manifest (see utils.manifest) and hot-swaps the model on changes
+"""
+import asyncio
+import os
+
+import data
+from utils.gcs_connector import retrieve_manifest, list_dir, run_io
+from utils import manifest
+
+poll_interval = float(os.getenv("MANIFEST_POLL_SECONDS", 60))
+daemon_task = None
+
+
+async def load_manifest():
+    """
+    Load the model manifest from the bucket
+    Buckets without a manifest file are listed once instead, with the model version from the environment
+    :return: Manifest
+    """
+    current = await run_io(retrieve_manifest)
+    if current is None:
+        names = await run_io(list_dir, "metadata")
+        current = manifest.from_listing(data.model_version, names)
+    return current
+
+
+async def start_manifest_daemon():
+    """
+    Load the manifest and start polling it in the background
+    Must be called from the event loop
+    """
+    global daemon_task
+    try:
+        await data.swap_manifest(await load_manifest())
+    except Exception as e:
+        pass #keep serving with the defaults, the daemon tries again
+    daemon_task = asyncio.create_task(manifest_daemon())
+
+
+async def manifest_daemon():
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            await poll_manifest()
+        except Exception as e:
+            pass #keep the current model, the next poll tries again
+
+
+async def poll_manifest():
+    """
+    Check the manifest file once and swap to it if it changed
+    Only the small manifest file is read, the bucket is only listed again if no resolutions could be loaded so far
+    :return: True if the manifest was swapped
+    """
+    current = await run_io(retrieve_manifest) if data.manifest.resolutions else await load_manifest()
+    if current is None or current.to_dict() == data.manifest.to_dict():
+        return False
+    await data.swap_manifest(current)
+    return True
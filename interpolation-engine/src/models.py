@@ -3,6 +3,7 @@ Here are all the pydantic models used in this application used for input validat
 """
 
 from datetime import datetime
+from enum import IntEnum
 
 from pydantic import BaseModel, field_validator, Field
 from typing_extensions import Annotated
@@ -38,6 +39,7 @@ class PolygonGeometry(BaseModel):
 
 class CellProperties(BaseModel):
     cell : str = Field(..., title="s2 cell id", description="s2 cell id to be supplied to data endpoint")
+    resolution : Optional[int] = Field(None, title="resolution", description="resolution of the cell to be supplied to data endpoint, differs between the cells of distance-adaptive coverings")
 
 class SensorData(BaseModel):
     time: datetime
@@ -62,4 +64,12 @@ class OutputPolygonFeature(BaseModel):
 class Covering(BaseModel):
     type : str = "FeatureCollection"
     properties : SensorDataProperties
-    features: List[OutputPolygonFeature]
\ No newline at end of file
+    features: List[OutputPolygonFeature]
+
+
+class Precision(IntEnum):
+    """
+    Bits per value of the wind components in /data responses
+    """
+    single = 32
+    half = 16
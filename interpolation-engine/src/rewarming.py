@@ -0,0 +1,95 @@
+"""
+Background re-interpolation of the most requested chunks whenever a new sensor reading arrives
+
+The release of a new reading to the clients is staggered over sensor_daemon.stagger_seconds (see get_sensor_info)
+The hot chunks are re-interpolated for the new reading at an even pace within a share of that window, so that the
+first clients that receive the new reading already find their chunks in the result cache
+"""
+import asyncio
+import os
+
+import data
+import sensor_daemon
+
+#share of the stagger window in which the re-interpolation should be finished
+window_share = float(os.getenv("REWARM_WINDOW_SHARE", 0.5))
+#number of most requested chunks that are re-interpolated per new reading
+max_chunks = int(os.getenv("REWARM_MAX_CHUNKS", 500))
+#re-interpolation pauses while more /data requests than this are processed
+max_live_requests = int(os.getenv("REWARM_MAX_LIVE_REQUESTS", 2))
+yield_interval = 0.05
+
+current_task = None
+
+
+def start_rewarming():
+    """
+    Register the re-interpolation for new readings of the reference sensor
+    Must be called from the event loop
+    """
+    if os.getenv("REWARM_ON_SENSOR_UPDATE", "True") != "True":
+        return
+    loop = asyncio.get_running_loop()
+
+    def on_sensor_update(sensor_id, ws, wd):
+        if sensor_id == sensor_daemon.default_sensor:
+            loop.call_soon_threadsafe(schedule_rewarm, ws, wd)
+
+    sensor_daemon.add_listener(on_sensor_update)
+
+
+def schedule_rewarm(ws, wd):
+    """
+    Start re-interpolating the hot chunks for a new reading, replacing a re-interpolation for an older reading
+    """
+    global current_task
+    if current_task is not None and not current_task.done():
+        current_task.cancel()
+    current_task = asyncio.create_task(rewarm(ws, wd))
+
+
+def take_hot_chunks():
+    """
+    Get the most requested chunks and halve all request counts, so that the ranking follows recent traffic
+    :return: list of (cell, resolution), most requested first
+    """
+    hot = [key for key, _ in data.request_counts.most_common(max_chunks)]
+    for key in list(data.request_counts.keys()):
+        data.request_counts[key] = data.request_counts[key] // 2
+        if data.request_counts[key] == 0:
+            del data.request_counts[key]
+    return hot
+
+
+async def rewarm(ws, wd):
+    """
+    Re-interpolate the hot chunks for the given reading, evenly paced over the configured share of the stagger window
+    Yields to live traffic: while /data requests are processed, the re-interpolation waits
+    Chunks that could not be done before the end of the window are skipped, as the clients request them by then anyway
+    Results are cached per wind direction, so a reading that only changes the wind speed finds all chunks cached already
+    """
+    loop = asyncio.get_running_loop()
+    hot = take_hot_chunks()
+    if not hot:
+        return
+    window = rewarm_window()
+    deadline = loop.time() + window
+    interval = window / len(hot)
+    for cell, resolution in hot:
+        start = loop.time()
+        while data.live_requests > max_live_requests and loop.time() < deadline:
+            await asyncio.sleep(yield_interval)
+        if loop.time() >= deadline:
+            return
+        try:
+            await data.warm_result(cell, resolution, ws, wd)
+        except Exception as e:
+            pass #best effort, the chunk will be interpolated on request instead
+        await asyncio.sleep(max(0.0, interval - (loop.time() - start)))
+
+
+def rewarm_window():
+    """
+    Length of the time window in seconds in which the re-interpolation should be finished
+    """
+    return sensor_daemon.stagger_seconds * window_share
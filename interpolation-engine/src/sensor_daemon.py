@@ -3,31 +3,71 @@ Offers background daemon for querying the database for the current wind sensor r
 + access to the read sensor data for other components
 """
 import asyncio
+import os
 import random
 import datetime
+import json
 import time
 
-import pandas
-
 import models
 from utils.db_connector import get_engine
-from threading import Lock
-import pandas as pd
+from utils import sensor_ingest, shared_snapshot
 from concurrent.futures import ThreadPoolExecutor
 
 engine = get_engine("sensor", pool=False)
-mutex = Lock()
+#current SensorState per sensor id. Never modified, the daemon replaces the whole dict ==> readers need no lock
 sensors = {}
 timestamp_format = '%Y-%m-%d %H:%M:%S'
 stagger_seconds = 57
 bucket_value_range_max = 100000
 daemon_wait = 1
+default_sensor = "EN" #reference sensor used for the interpolation
+listeners = []
+#how new readings are fetched from the database, see utils.sensor_ingest
+ingest_mode = os.getenv("SENSOR_INGEST_MODE", "incremental")
+reader = sensor_ingest.make_reader(ingest_mode)
+#only one worker per host queries the database and shares the readings with the other workers through shared memory
+#(see utils.shared_snapshot) ==> one database connection per host, and all workers stagger the same reading
+share_across_workers = os.getenv("SENSOR_SHARE_ACROSS_WORKERS", "True") == "True"
+if share_across_workers:
+    #a leader that fails <SENSOR_LEADER_MAX_FAILURES> refreshes in a row hands over to another worker
+    leader_lock = shared_snapshot.LeaderLock(os.getenv("SENSOR_LOCK_FILE", os.path.join(shared_snapshot.default_directory, "wind-sensors.lock")),
+                                             int(os.getenv("SENSOR_LEADER_MAX_FAILURES", 3)))
+    shared = shared_snapshot.SharedSnapshot(os.getenv("SENSOR_SHARED_FILE", os.path.join(shared_snapshot.default_directory, "wind-sensors")))
+shared_sequence = 0 #sequence number of the last snapshot taken over from the leader
 
 def db_daemon():
     while True:
-        query_database()
+        #a failed refresh must not end the daemon thread, the worker would keep serving its last reading (and a
+        #leader would keep holding the lock) forever
+        try:
+            refresh()
+        except Exception as e:
+            print(json.dumps({"message": f"Sensor refresh failed: {e!r}", "severity": "ERROR"}))
         time.sleep(daemon_wait)
 
+
+def refresh():
+    """
+    Update the sensor readings
+    The leader of the host queries the database and publishes new readings, all other workers take over the published readings
+    If the leader dies or keeps failing, another worker becomes the leader with its next refresh
+    """
+    if not share_across_workers:
+        query_database()
+    elif leader_lock.try_acquire():
+        try:
+            updated = query_database()
+            if updated:
+                publish_shared()
+        except Exception:
+            if leader_lock.record(False):
+                print(json.dumps({"message": "Sensor leader gave up the lock after repeated failures", "severity": "WARNING"}))
+            raise
+        leader_lock.record(True)
+    else:
+        read_shared()
+
 def start_sensor_db_daemon():
     """
     Start the sensor daemon, which will periodically query the database in the background
@@ -38,12 +78,75 @@ def start_sensor_db_daemon():
 
 
 
+def add_listener(listener):
+    """
+    Register a function that is called whenever a new reading of a sensor was read from the database
+    Listeners are called from the daemon thread with the arguments (sensor_id, ws, wd) and must not block
+    """
+    listeners.append(listener)
+
+
+class SensorState:
+    """
+    Immutable snapshot of the latest reading of a sensor
+    Never modified after creation, new readings are published by swapping the sensors dict (see publish_sensors)
+    """
+    __slots__ = ("time", "ws", "wd", "last", "read", "first_read", "reading")
+
+    def __init__(self, time, ws, wd, last, read, first_read):
+        """
+        :param time: timestamp of the reading
+        :param last: timestamp of the previous reading
+        :param read: local time at which this reading was read from the database
+        :param first_read: set if this is the first reading after the startup of the instance
+        """
+        self.time = time
+        self.ws = ws
+        self.wd = wd
+        self.last = last
+        self.read = read
+        self.first_read = first_read
+        try:
+            #validated once here, requests only copy it with their own bucket
+            self.reading = models.SensorData(time=time, ws=ws, wd=wd, bucket=0)
+        except ValueError:
+            self.reading = None
+
+    def to_sensor_data(self, bucket):
+        """
+        Create the sensor data for a client
+        :param bucket: time bucket of the client
+        :return: SensorData
+        """
+        if self.reading is None: #invalid readings fail on request, as they always did
+            return models.SensorData(time=self.time, wd=self.wd, ws=self.ws, bucket=bucket)
+        return self.reading.model_copy(update={"bucket": float(bucket)})
+
+    def to_dict(self):
+        return {key: value.isoformat() if hasattr(value, "isoformat") else value
+                for key, value in [("time", self.time), ("ws", self.ws), ("wd", self.wd), ("last", self.last),
+                                   ("read", self.read), ("first_read", self.first_read)]}
+
+    @classmethod
+    def from_dict(cls, entry):
+        times = [datetime.datetime.fromisoformat(entry[key]) for key in ["time", "last", "read"]]
+        return cls(times[0], entry["ws"], entry["wd"], times[1], times[2], entry["first_read"])
+
+
+def publish_sensors(new_sensors):
+    """
+    Helper function to replace the current sensor states
+    A single assignment ==> readers either see the old or the new dict, never a partially updated one
+    """
+    global sensors
+    sensors = new_sensors
+
+
 def get_sensors():
     """
     Get the names of the available sensors
     """
-    with mutex:
-        return list(sensors.keys())
+    return list(sensors.keys())
 
 
 def get_sensor_info(sensor_id, last_client_data : models.SensorData = None, client = None):
@@ -54,21 +157,21 @@ def get_sensor_info(sensor_id, last_client_data : models.SensorData = None, clie
     ==> Avoids overload when the sensor data is updated and all client requests for the data will lead to cache miss
     ==> The load peak is thus stretched out
 
-    Is thread-safe (for case of concurrent read and write)
+    Is thread-safe without locking, as it only reads one immutable SensorState
     :param sensor_id: name of sensor
     :param last_client_data: last sensor update received by the client (contained in body of following requests)
     :param: client: client address to determine the time bucket for the staggering
     :return: sensor data to be sent back to the client
     """
-    if sensor_id not in sensors:
+    state = sensors.get(sensor_id)
+    if state is None:
         return None
     bucket = last_client_data.bucket if last_client_data else random.uniform(0, bucket_value_range_max)  # dont reveal exact bucket to client
-    with mutex:
-        #create sensor data object and assign time bucket to client for next update
-        current_sensor_reading = models.SensorData(time=sensors[sensor_id]["time"], wd=sensors[sensor_id]["wd"], ws=sensors[sensor_id]["ws"], bucket=bucket)
-        last = sensors[sensor_id]["last"]
-        first_read = sensors[sensor_id]["first_read"]
-        read = sensors[sensor_id]["read"]
+    #create sensor data object and assign time bucket to client for next update
+    current_sensor_reading = state.to_sensor_data(bucket)
+    last = state.last
+    first_read = state.first_read
+    read = state.read
 
     if last_client_data and client:
         if first_read: #only applies immediately after startup of instance
@@ -92,35 +195,75 @@ def get_sensor_info(sensor_id, last_client_data : models.SensorData = None, clie
 def query_database():
     """
     Helper function to query database for sensor data
-    Fills the sensor dict with latest info
-    is thread-safe
+    Publishes new sensor states for the sensors with a new reading
+    Must only be called from one thread at a time (the daemon thread, or at initialization)
+    :return: list of (sensor_id, ws, wd) of the sensors with a new reading
     """
     with engine.connect() as conn:
-        df : pd.DataFrame = pandas.read_sql('''SELECT * FROM "public"."sensors-to-cloud-data" ''', conn)
-    sensor_ids = list(map(lambda s : s.split("_")[0], filter(lambda c : c.endswith("_ms"), df.columns.values.tolist())))
-    row = df.iloc[0]
-    for sensor_id in sensor_ids:
-        if sensor_id == "ILR":
+        reading = reader.read(conn)
+    if reading is None: #no new row since the last query
+        return []
+    timestamp, readings = reading
+    new_sensors = dict(sensors)
+    updated = []
+    for sensor_id, (ws, wd) in readings.items():
+        previous = sensors.get(sensor_id)
+        if previous is not None and previous.time == timestamp:
             continue
 
-        if sensor_id in sensors and sensors[sensor_id]["time"] == row["TIMESTAMP"]:
-            continue
-        if sensor_id in sensors:
-            sensors[sensor_id]["last"] = sensors[sensor_id]["time"]
-
-        first_read = sensor_id not in sensors
+        first_read = previous is None
 
-        last = sensors[sensor_id]["last"] if not first_read else datetime.datetime.fromtimestamp(30000000000)
+        last = previous.time if not first_read else datetime.datetime.fromtimestamp(30000000000)
         now = datetime.datetime.now()
-        with mutex:
-            sensors[sensor_id] = {}
-            sensors[sensor_id]["last"] = last
-            sensors[sensor_id]["first_read"] = first_read
-            sensors[sensor_id]["read"] = now
-            sensors[sensor_id]["time"] = row["TIMESTAMP"]
-            sensors[sensor_id]["ws"] = float(row[f"{sensor_id}_RAW_CV50_Wind_ms"])
-            sensors[sensor_id]["wd"] = float(row[f"{sensor_id}_RAW_CV50_WindDirection_deg"])
+        new_sensors[sensor_id] = SensorState(timestamp, ws, wd, last, now, first_read)
+        updated.append((sensor_id, ws, wd))
+
+    publish_sensors(new_sensors)
+    notify_listeners(updated)
+    return updated
+
+
+def notify_listeners(updated):
+    for sensor_id, ws, wd in updated:
+        for listener in listeners:
+            listener(sensor_id, ws, wd)
+
+
+def publish_shared():
+    """
+    Helper function to publish the sensor states to the other workers of the host
+    """
+    entries = {sensor_id: state.to_dict() for sensor_id, state in sensors.items()}
+    shared.publish(json.dumps(entries).encode())
+
+
+def read_shared():
+    """
+    Helper function to take over the sensor readings published by the leader of the host
+    :return: True if readings were available
+    """
+    global shared_sequence
+    snapshot = shared.read()
+    if snapshot is None or snapshot[1] is None:
+        return False
+    sequence, payload = snapshot
+    if sequence == shared_sequence:
+        return True
+    new_sensors = dict(sensors)
+    updated = []
+    for sensor_id, entry in json.loads(payload).items():
+        state = SensorState.from_dict(entry)
+        if sensor_id not in sensors or sensors[sensor_id].time != state.time:
+            updated.append((sensor_id, state.ws, state.wd))
+        new_sensors[sensor_id] = state
+    publish_sensors(new_sensors)
+    shared_sequence = sequence
+    notify_listeners(updated)
+    return True
 
 
 #Query once at initialization time
-query_database()
\ No newline at end of file
+if not share_across_workers or leader_lock.try_acquire():
+    refresh()
+elif not read_shared(): #the leader has not published anything yet
+    query_database()
\ No newline at end of file
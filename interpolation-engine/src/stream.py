@@ -0,0 +1,103 @@
+"""
+Progressive streaming of the wind data of a view, from coarse to fine resolutions
+
+The covering of the view is computed at several resolutions of the model pyramid. The chunks of the coarsest
+resolution are sent first, so the client can render the whole view after a few small chunks, followed by the chunks of
+the finer resolutions cell by cell as they are interpolated. The client replaces the coarse data of an area once the
+finer cells of that area arrive (the S2 children of a cell cover exactly its area)
+"""
+import os
+s2mock = False if os.getenv('CLOUD') is None else not os.getenv('CLOUD') == "True"
+if s2mock:
+    from utils import s2mock as s2 #s2mock exists for testing on systems where s2geometry doesnt compile
+else:
+    from utils import s2 as s2
+import asyncio
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Path, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette import status
+from sensor_daemon import get_sensor_info, default_sensor
+from models import InputPolygonFeature, Precision
+from utils import serializers
+import data
+
+app = APIRouter()
+
+
+@app.post("/{resolution}/3d", responses={400: {"detail": "Invalid args or body"}})
+async def stream(request : Request,
+                 poly : InputPolygonFeature,
+                 resolution : int = Path(..., description="Finest resolution of the stream, the last one that is sent", gt=0),
+                 levels : int = Query(3, description="Number of resolutions that are streamed, the given one and the next coarser ones", ge=1),
+                 format : Literal["arrow", "raw"] = Query("arrow", description="Response encoding (arrow or raw), parquet cannot be streamed"),
+                 precision : Precision = Query(Precision.single, description=data.precision_description),
+                 altitude : Optional[float] = Query(None, description=data.altitude_description),
+                 max_altitude : Optional[float] = Query(None, description=data.max_altitude_description)):
+    """
+    Streams the wind data of a view progressively, from coarse to fine resolutions
+
+    The request body is the polygon of the view, with the same rules as for the /covering endpoint (including the optional
+    properties.sensor_data block). The data is interpolated for the current sensor reading, which is sent as JSON in the
+    X-Sensor-Data header
+
+    The response is streamed with chunked transfer encoding and has the schema [cell, lat, lon, z, u, v, w] of the batch
+    endpoint, every cell is one record batch (arrow) or message (raw). All cells of the coarsest of the streamed resolutions
+    are sent first, then all cells of the next finer one, down to the given resolution. The resolution of a cell follows
+    from the level of its cell id
+
+    The stream stops as soon as the client disconnects, chunks that were not sent yet are not interpolated
+    """
+    try:
+        if poly.properties is not None and poly.properties.sensor_data is not None:
+            sensor_data = get_sensor_info(default_sensor, poly.properties.sensor_data, request.client)
+        else:
+            sensor_data = get_sensor_info(default_sensor)
+        altitudes = data.altitude_range(altitude, max_altitude)
+        resolutions = data.pyramid_resolutions(resolution)[:levels]
+        indexes = await asyncio.gather(*[data.get_cell_index(r) for r in resolutions])
+        coverings = [(r, s2.compute_covering_ids(poly, r, index)) for r, index in zip(resolutions, indexes)][::-1]
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid args or body")
+    if sensor_data is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="No sensor data")
+
+    #start loading the chunks of the finer resolutions while the coarse ones are sent
+    for r, cells in coverings[1:]:
+        data.schedule_prefetch(cells, r)
+
+    headers = {"Cache-Control": "no-store", "X-Sensor-Data": sensor_data.model_dump_json()}
+    frames = stream_frames(request, coverings, sensor_data.ws, sensor_data.wd, format, precision, altitudes)
+    return StreamingResponse(frames, media_type=serializers.media_types[format], headers=headers)
+
+
+async def stream_frames(request, coverings, ws, wd, encoding, precision, altitudes):
+    """
+    Helper generator that interpolates and encodes the chunks of a stream one by one
+    :param coverings: list of (resolution, cell ids), in the order in which they are sent
+    :return: async generator of encoded bytes
+    """
+    encoder = serializers.stream_encoders[encoding]()
+    sent = 0
+    for resolution, cells in coverings:
+        A, WDref = await data.query_additional_data(resolution)
+        if A is None:
+            continue
+        modes = data.request_modes(resolution, A, None)
+        data.request_counts.update((cell, resolution) for cell in cells)
+        for cell in cells:
+            if await request.is_disconnected():
+                return
+            with data.live_request():
+                model = await data.get_chunk_model(cell, resolution, A)
+                if model is None:
+                    continue
+                u, v, w = data.get_result(cell, resolution, model, A, WDref, ws, wd, modes, altitudes)
+                frames = data.encode_frames([(cell, model, u, v, w)], resolution, precision, encoding, True, altitudes)
+            sent = sent + 1
+            yield encoder.encode(frames)
+    if sent == 0:
+        #an empty frame, so that the client still receives the schema
+        yield encoder.encode(data.encode_frames([(0, None, None, None, None)], 0, precision, encoding, True))
+    yield encoder.close()
@@ -0,0 +1,132 @@
+"""
+In-memory caches that are bounded by the size of their entries in bytes instead of their count
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+class SizedCache:
+    """
+    Segmented LRU cache (SLRU) bounded by the total byte size of its entries
+
+    New entries are admitted to a probation segment. Entries that are hit again while on probation are promoted to the
+    protected segment, which may hold up to <protected_share> of the byte budget.
+    Eviction always starts at the least recently used entry on probation
+    ==> entries that were only requested once are dropped before frequently requested ones, and within each segment the
+    least recently used entry goes first
+
+    Is thread-safe
+    """
+
+    def __init__(self, max_bytes, size_of, protected_share=0.8):
+        """
+        :param max_bytes: upper bound for the summed size of all entries
+        :param size_of: function that returns the size of a value in bytes
+        :param protected_share: share of the budget reserved for entries that were hit more than once
+        """
+        self.max_bytes = max_bytes
+        self.max_protected_bytes = int(max_bytes * protected_share)
+        self.size_of = size_of
+        self.lock = Lock()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Look up a value and update its recency and frequency
+        :return: cached value or default, if not cached
+        """
+        with self.lock:
+            if key in self.protected:
+                self.protected.move_to_end(key)
+                self.hits = self.hits + 1
+                return self.protected[key][0]
+            if key in self.probation:
+                value, size = self.probation.pop(key)
+                self.probation_bytes = self.probation_bytes - size
+                self.protected[key] = (value, size)
+                self.protected_bytes = self.protected_bytes + size
+                self._demote()
+                self.hits = self.hits + 1
+                return value
+            self.misses = self.misses + 1
+            return default
+
+    def put(self, key, value):
+        """
+        Insert a value, evicting other entries if the byte budget is exceeded
+        Values larger than the whole budget are not admitted
+        """
+        size = self.size_of(value)
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.probation[key] = (value, size)
+            self.probation_bytes = self.probation_bytes + size
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self.lock:
+            self.probation.clear()
+            self.protected.clear()
+            self.probation_bytes = 0
+            self.protected_bytes = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.protected or key in self.probation
+
+    def __len__(self):
+        with self.lock:
+            return len(self.protected) + len(self.probation)
+
+    def stats(self):
+        """
+        :return: dict with the hit/miss/eviction counters and the current occupancy
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.protected) + len(self.probation),
+                "bytes": self.protected_bytes + self.probation_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _remove(self, key):
+        if key in self.probation:
+            self.probation_bytes = self.probation_bytes - self.probation.pop(key)[1]
+        elif key in self.protected:
+            self.protected_bytes = self.protected_bytes - self.protected.pop(key)[1]
+
+    def _demote(self):
+        """
+        Move least recently used entries from the protected segment back to probation while it exceeds its share
+        """
+        while self.protected_bytes > self.max_protected_bytes and len(self.protected) > 1:
+            key, (value, size) = self.protected.popitem(last=False)
+            self.protected_bytes = self.protected_bytes - size
+            self.probation[key] = (value, size)
+            self.probation_bytes = self.probation_bytes + size
+
+    def _evict(self):
+        while self.probation_bytes + self.protected_bytes > self.max_bytes:
+            segment = self.probation if self.probation else self.protected
+            _, (_, size) = segment.popitem(last=False)
+            if segment is self.probation:
+                self.probation_bytes = self.probation_bytes - size
+            else:
+                self.protected_bytes = self.protected_bytes - size
+            self.evictions = self.evictions + 1
@@ -0,0 +1,50 @@
+"""
+Index of the cells that have a chunk, per resolution
+Stored as metadata/{resolution}_cells.npy next to A and WDref: a sorted numpy array of uint64 cell ids
+(written by the pod pipeline, see pod/chunk_format.py cell_index_to_bytes)
+"""
+import io
+
+import numpy as np
+
+
+def index_path(resolution):
+    """
+    :return: path of the cell index of a resolution inside the bucket
+    """
+    return f"metadata/{resolution}_cells.npy"
+
+
+def from_bytes(data):
+    """
+    Decode a cell index file
+    :param data: bytes-like object with the content of the .npy file
+    :return: sorted numpy array of uint64 cell ids
+    """
+    index = np.load(io.BytesIO(data)).astype("uint64", copy=False)
+    return np.sort(index)
+
+
+def contains(index, cells):
+    """
+    Check which cells have a chunk
+    :param index: sorted numpy array of uint64 cell ids
+    :param cells: list of cell ids as integers
+    :return: boolean numpy array, True for each cell that has a chunk
+    """
+    cells = np.asarray(cells, dtype="uint64")
+    if len(index) == 0:
+        return np.zeros(len(cells), dtype=bool)
+    positions = np.minimum(np.searchsorted(index, cells), len(index) - 1)
+    return index[positions] == cells
+
+
+def filter_cells(index, cells):
+    """
+    Remove the cells without a chunk, keeping the order
+    :param index: sorted numpy array of uint64 cell ids, or None if there is no index (==> nothing is removed)
+    :return: list of cell ids
+    """
+    if index is None or not cells:
+        return cells
+    return [cell for cell, exists in zip(cells, contains(index, cells)) if exists]
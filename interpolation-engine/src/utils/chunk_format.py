@@ -0,0 +1,101 @@
+"""
+Binary chunk format that can be mapped directly into the arrays of a ChunkModel, without pandas and without copies
+
+Layout (little-endian):
+    header      magic "WCHK", format version (uint16), float bits of means and Psi (uint16, 16 or 32),
+                number of datapoints N (uint32), number of POD modes M (uint32), zero-padded to 64 bytes
+    lat         float32[N]
+    lon         float32[N]
+    z           int32[N]
+    means       float[3N], stacked per wind component [u..., v..., w...]
+    Psi         float[M][3N], mode-major ==> every mode is one contiguous block
+
+Every section starts at a multiple of 64 bytes, so all arrays are aligned
+Psi is the last section and the modes are sorted by energy ==> the top-k modes are a prefix of the file, so a
+rank-truncated model only needs the first prefix_size(header, k) bytes
+The format is only written by the pod pipeline (pod/chunk_format.py), keep both in sync
+"""
+import struct
+
+import numpy as np
+from utils.chunk_model import ChunkModel
+
+MAGIC = b"WCHK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+float_types = {16: np.dtype("<f2"), 32: np.dtype("<f4")}
+
+
+def section_offsets(n_points, n_modes, float_bits):
+    """
+    Compute the byte offsets of all sections for a chunk of the given dimensions
+    :return: dict from section name to offset, including the total file size as "end"
+    """
+    float_size = float_types[float_bits].itemsize
+    sizes = [("lat", 4 * n_points), ("lon", 4 * n_points), ("z", 4 * n_points),
+             ("means", float_size * 3 * n_points), ("Psi", float_size * 3 * n_points * n_modes)]
+    offsets = {}
+    offset = HEADER_SIZE
+    for name, size in sizes:
+        offsets[name] = offset
+        offset = offset + size
+        offset = offset + (-offset % ALIGNMENT)
+    offsets["end"] = offset
+    return offsets
+
+
+def read_header(buffer):
+    """
+    Parse the header of a chunk file
+    :param buffer: bytes-like object with at least the first HEADER_SIZE bytes of the chunk file
+    :return: float bits, number of datapoints N and number of POD modes M
+    :raises ValueError: if the buffer does not contain a chunk of a supported version
+    """
+    if len(buffer) < HEADER_SIZE:
+        raise ValueError("Chunk file too short")
+    magic, version, float_bits, n_points, n_modes = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION or float_bits not in float_types:
+        raise ValueError("Unsupported chunk file")
+    return float_bits, n_points, n_modes
+
+
+def prefix_size(header, n_modes=None):
+    """
+    Number of bytes at the start of a chunk file that hold everything up to and including the first n_modes POD modes
+    :param header: bytes-like object with the header of the chunk file
+    :param n_modes: number of leading modes to read, None for all modes
+    :return: size of the prefix in bytes
+    """
+    float_bits, n_points, total_modes = read_header(header)
+    offsets = section_offsets(n_points, total_modes, float_bits)
+    if n_modes is None or n_modes >= total_modes:
+        return offsets["end"]
+    return offsets["Psi"] + float_types[float_bits].itemsize * 3 * n_points * n_modes
+
+
+def read_chunk(buffer, n_modes=None):
+    """
+    Map a chunk file into a ChunkModel
+    All arrays of the model are read-only views on the buffer, so the buffer is kept alive as long as the model is
+    :param buffer: bytes-like object with the content of the chunk file (e.g. bytes or a memory map). If n_modes is
+    given, the prefix of the file up to prefix_size(buffer, n_modes) is sufficient
+    :param n_modes: if given, only the first n_modes POD modes are mapped into the model
+    :return: ChunkModel
+    :raises ValueError: if the buffer does not contain a chunk of a supported version
+    """
+    float_bits, n_points, total_modes = read_header(buffer)
+    n_modes = total_modes if n_modes is None else min(n_modes, total_modes)
+    offsets = section_offsets(n_points, total_modes, float_bits)
+    if len(buffer) < prefix_size(buffer, n_modes):
+        raise ValueError("Chunk file too short")
+    float_type = float_types[float_bits]
+
+    lat = np.frombuffer(buffer, dtype="<f4", count=n_points, offset=offsets["lat"])
+    lon = np.frombuffer(buffer, dtype="<f4", count=n_points, offset=offsets["lon"])
+    z = np.frombuffer(buffer, dtype="<i4", count=n_points, offset=offsets["z"])
+    means = np.frombuffer(buffer, dtype=float_type, count=3 * n_points, offset=offsets["means"])
+    PsiT = np.frombuffer(buffer, dtype=float_type, count=3 * n_points * n_modes, offset=offsets["Psi"])
+    PsiT = PsiT.reshape((n_modes, 3 * n_points))
+    return ChunkModel(lat, lon, z, means, PsiT.T)
@@ -0,0 +1,129 @@
+"""
+Decoded representation of a chunk of the POD wind model, as it is kept in memory by the engine
+"""
+import numpy as np
+
+
+class ChunkModel:
+    """
+    Interpolation parameters and coordinates of all datapoints in one chunk
+
+    lat, lon and z have one entry per datapoint (N)
+    means and the rows of Psi are stacked per wind component [u..., v..., w...] (3N)
+    Psi has one column per POD mode. It is stored mode-major (Psi.T is C-contiguous), so that every mode is one
+    contiguous block, the same layout as in the binary chunk format
+
+    If the basis was precomputed (see precompute_basis), the model instead holds one unscaled wind field per reference
+    direction in basis and no longer needs means and Psi
+    """
+
+    def __init__(self, lat, lon, z, means, Psi, basis=None):
+        self.lat = lat
+        self.lon = lon
+        self.z = z
+        self.means = means
+        self.Psi = Psi
+        self.basis = basis
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def nbytes(self):
+        """
+        Memory occupied by the arrays of the model, used as its size for caching
+        """
+        arrays = [self.lat, self.lon, self.z, self.means, self.Psi, self.basis]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+
+def from_df(df):
+    """
+    Extract the chunk model from a chunk dataframe generated by model_generation.generate
+    :param df: pandas dataframe with the point-specific interpolation parameters
+    :return: ChunkModel
+    """
+    lat = df["lat"].to_numpy(dtype="float32")
+    lon = df["lon"].to_numpy(dtype="float32")
+    z = df["z"].to_numpy(dtype="int32")
+    means = np.concatenate([df["mean_u"].to_numpy(), df["mean_v"].to_numpy(), df["mean_w"].to_numpy()], axis=0)
+
+    Psi_u = df[[col for col in df.columns if col.startswith("u_")]].to_numpy()
+    Psi_v = df[[col for col in df.columns if col.startswith("v_")]].to_numpy()
+    Psi_w = df[[col for col in df.columns if col.startswith("w_")]].to_numpy()
+    PsiT = np.concatenate([Psi_u.T, Psi_v.T, Psi_w.T], axis=1)  # mode-major
+    return ChunkModel(lat, lon, z, means, PsiT.T)
+
+
+def mode_columns(columns, n_modes):
+    """
+    Select the columns of a chunk dataframe that are needed for a model with only the first n_modes POD modes
+    The mode columns of each wind component are in the order of the modes, as written by model_generation.generate
+    :param columns: names of all columns of the chunk
+    :param n_modes: number of leading modes to keep
+    :return: list of column names, in the original order
+    """
+    keep = set()
+    for c in ["u", "v", "w"]:
+        keep.update([col for col in columns if col.startswith(f"{c}_")][:n_modes])
+    return [col for col in columns if col in keep or col[:2] not in ["u_", "v_", "w_"]]
+
+
+def altitude_rows(model, low, high):
+    """
+    Find the datapoints of a chunk within an altitude range
+    The binary chunk writer sorts the rows by z (see pod/chunk_format.py), so the rows of the range are found with a
+    binary search and form one contiguous block. Parquet chunks and older binary chunks are searched with a mask instead
+    :param low: lowest altitude (z) to include
+    :param high: highest altitude (z) to include
+    :return: slice or numpy array with the row indices
+    """
+    z = model.z
+    if np.all(z[:-1] <= z[1:]):
+        return slice(int(np.searchsorted(z, low, side="left")), int(np.searchsorted(z, high, side="right")))
+    return np.flatnonzero((z >= low) & (z <= high))
+
+
+def select_rows(model, rows, coordinates_only=False):
+    """
+    Create a chunk model with only some of the datapoints of a chunk
+    Coordinates are views if rows is a slice. The rows of means, Psi and the basis are copied, which costs about as
+    much as interpolating them once
+    :param rows: slice or numpy array with the row indices, see altitude_rows()
+    :param coordinates_only: if set, the new model only holds lat, lon and z (e.g. to encode a response)
+    :return: new ChunkModel
+    """
+    def stacked(array):
+        #array with the 3 wind components stacked along its last axis (3N) ==> same array with only the selected rows
+        if array is None or coordinates_only:
+            return None
+        selected = array.reshape(array.shape[:-1] + (3, len(model)))[..., rows]
+        return np.ascontiguousarray(selected).reshape(array.shape[:-1] + (-1,))
+
+    PsiT = stacked(model.Psi.T if model.Psi is not None else None)
+    return ChunkModel(model.lat[rows], model.lon[rows], model.z[rows], stacked(model.means),
+                      PsiT.T if PsiT is not None else None, basis=stacked(model.basis))
+
+
+def to_float32(model):
+    """
+    Convert Psi and the means of a chunk model to float32, keeping Psi mode-major
+    :return: new ChunkModel, or the same model if it is float32 already
+    """
+    if model.Psi.dtype == np.float32 and model.Psi.T.flags.c_contiguous:
+        return model
+    PsiT = np.ascontiguousarray(model.Psi.T, dtype="float32")
+    return ChunkModel(model.lat, model.lon, model.z, model.means.astype("float32"), PsiT.T)
+
+
+def precompute_basis(model, A):
+    """
+    Precompute the wind fields of a chunk at all reference directions (unscaled, so for a wind speed of 1)
+    The POD coefficients are interpolated linearly between neighbouring reference directions, and the field is linear in
+    the coefficients ==> the field for any direction is exactly the blend of the two neighbouring precomputed fields
+    :param model: ChunkModel with means and Psi
+    :param A: interpolation parameter created by model_generation.generate (modes x reference directions)
+    :return: new ChunkModel that only holds the coordinates and the basis (reference directions x 3N)
+    """
+    basis = (np.dot(A.T, model.Psi.T) + model.means).astype("float32")
+    return ChunkModel(model.lat, model.lon, model.z, None, None, basis=basis)
@@ -0,0 +1,115 @@
+"""
+Storage backends for the chunk files and metadata of the POD model
+All backends use the same layout as the bucket, so a local copy of the bucket can be served as is
+"""
+import hashlib
+import mmap
+import os
+from abc import ABC, abstractmethod
+
+root = "pre-calculation"
+
+
+def chunk_path(cell, resolution, extension="parquet"):
+    """
+    Path of the 3D chunk file for given S2 cell and resolution inside the store
+    Folder and file names are hashed to spread the chunks evenly over the key space of the bucket
+    :param extension: file extension of the chunk format ("parquet" or "chunk" for the binary format)
+    """
+    folder = f"{root}/downsampling-factor-{resolution}"
+    folder_hash = hashlib.md5(folder.encode()).hexdigest()
+    chunk_hash = hashlib.md5(f"{cell}".encode()).hexdigest()
+    return f"{folder_hash}/3d/{chunk_hash}.{extension}"
+
+
+class ChunkStore(ABC):
+    """
+    Interface for chunk storage backends
+    Implementations have to be thread-safe, as they are called from the storage thread pool
+    """
+
+    @abstractmethod
+    def read(self, path, end=None):
+        """
+        Read a whole file, or only its beginning
+        :param path: path of the file inside the store
+        :param end: if given, only the first end bytes are needed (the result may still contain more)
+        :return: bytes-like object with the content of the file
+        :raises Exception: if the file does not exist or could not be read
+        """
+
+    @abstractmethod
+    def list(self, prefix):
+        """
+        List all files whose path starts with the given prefix
+        :return: list of paths inside the store
+        """
+
+
+class GCSChunkStore(ChunkStore):
+    """
+    Reads the files from a Google Cloud Storage bucket
+    """
+
+    def __init__(self, bucket_name, timeout=10.0):
+        #only imported here, so that the engine can run without the GCS client library when using a local store
+        from google.cloud import storage
+        from google.api_core.retry import Retry
+
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.timeout = timeout
+        #Exponential back-off config for cloud storage
+        self.retry = Retry(
+            initial=0.2,
+            multiplier=3,
+            deadline=5.0
+        )
+
+    def read(self, path, end=None):
+        blob = self.bucket.blob(path)
+        #ranged download, end is inclusive for the client
+        return blob.download_as_bytes(end=None if end is None else end - 1, retry=self.retry, timeout=self.timeout)
+
+    def list(self, prefix):
+        blobs = self.bucket.list_blobs(prefix=prefix)
+        return [blob.name for blob in blobs]
+
+
+class LocalChunkStore(ChunkStore):
+    """
+    Reads the files from a local directory with the same layout as the bucket
+    Files are memory-mapped instead of read, so the data is only paged in from disk when accessed and never copied
+    into the heap of the process
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def read(self, path, end=None):
+        #the whole file is mapped, only the pages that are accessed are read from disk anyway
+        with open(os.path.join(self.directory, path), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            #the mapping stays valid after closing the file and is released once all views on it are gone
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def list(self, prefix):
+        names = []
+        #only walk the directory that contains the prefix
+        for dir_path, _, files in os.walk(os.path.join(self.directory, os.path.dirname(prefix))):
+            for file in files:
+                name = os.path.relpath(os.path.join(dir_path, file), self.directory).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        return names
+
+
+def from_env():
+    """
+    Create the chunk store configured through the environment
+    LOCAL_CHUNK_DIR selects the local directory store, otherwise the bucket CHUNK_BUCKET is used
+    """
+    local_dir = os.getenv('LOCAL_CHUNK_DIR')
+    if local_dir is not None:
+        return LocalChunkStore(local_dir)
+    return GCSChunkStore(os.getenv('CHUNK_BUCKET'), timeout=float(os.getenv('STORAGE_IO_TIMEOUT', 10.0)))
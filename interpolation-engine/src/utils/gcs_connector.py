@@ -1,46 +1,83 @@
-import io
-import hashlib
+import asyncio
+import functools
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
-from google.cloud import storage
-from google.api_core.retry import Retry
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utils import chunk_store, chunk_format, chunk_model, cell_index, manifest
 
-storage_client = storage.Client()
-BUCKET_NAME = os.getenv('CHUNK_BUCKET')
-bucket = storage_client.bucket(BUCKET_NAME)
-root = "pre-calculation"
+#Backend from which chunks and metadata are read, either the GCS bucket or a local directory with the same layout
+#(see utils.chunk_store.from_env)
+store = chunk_store.from_env()
+#Format of the chunk files, either "parquet" or "binary" (see utils.chunk_format)
+CHUNK_FORMAT = os.getenv('CHUNK_FORMAT', "parquet")
 
-#Exponential back-off config for cloud storage
-custom_retry = Retry(
-    initial=0.2,
-    multiplier=3,
-    deadline=5.0
-)
+#Blocking storage calls are run in this bounded pool, so that they dont block the event loop of the worker
+io_executor = ThreadPoolExecutor(max_workers=int(os.getenv('STORAGE_IO_THREADS', 32)), thread_name_prefix="storage-io")
+#Timeout in seconds for a single storage call, including the time spent waiting for a free thread
+io_timeout = float(os.getenv('STORAGE_IO_TIMEOUT', 10.0))
 
-def retrieve_df(cell, resolution, altitude=None):
+
+async def run_io(function, *args, timeout=None):
+    """
+    Run a blocking storage function in the storage thread pool without blocking the event loop
+    If the timeout expires or the awaiting task is cancelled, calls that have not started yet are dropped from the queue.
+    Calls that are already running finish in the background (bounded by the timeouts of the storage client) and their result is discarded
+    :param function: blocking function to call
+    :param args: arguments for the function
+    :param timeout: timeout in seconds, defaults to io_timeout
+    :return: return value of the function
+    :raises asyncio.TimeoutError: if the call did not finish in time
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(io_executor, functools.partial(function, *args))
+    return await asyncio.wait_for(future, io_timeout if timeout is None else timeout)
+
+def retrieve_df(cell, resolution, modes=None):
     """
     Downloads the file with the interpolation parameters for given S2 cell and resolution
-    Altitude is ignored for now, as we only query 3D views
+    Always the whole 3D chunk, single altitudes are selected from the decoded model (see chunk_model.altitude_rows)
+    :param modes: if given, only the columns of the first modes POD modes are decoded
     :return: pandas dataframe
     """
-    folder = f"{root}/downsampling-factor-{resolution}"
-    if altitude is None or True: #Only query 3d chunks for now
-        chunk = f"{cell}"
-        folder_hash = hashlib.md5(folder.encode()).hexdigest()
-        chunk_hash = hashlib.md5(chunk.encode()).hexdigest()
-        file_name = f"{folder_hash}/3d/{chunk_hash}.parquet"
-    else:
-        chunk = f"{altitude}-{cell}"
-        file_name = f"{dir}/2d/{chunk}.parquet"
+    file_name = chunk_store.chunk_path(cell, resolution)
     try:
-        df = download_file_bytes(bucket, file_name)
+        data = store.read(file_name)
     except Exception as e:
         return None
-    df = pd.read_parquet(df)
+    #read through a pyarrow buffer, so memory-mapped files are decoded without copying them first
+    columns = None
+    if modes is not None:
+        columns = chunk_model.mode_columns(pq.read_schema(pa.BufferReader(data)).names, modes)
+    df = pq.read_table(pa.BufferReader(data), columns=columns).to_pandas()
     return df
 
+def retrieve_model(cell, resolution, modes=None):
+    """
+    Retrieve the decoded chunk model for given S2 cell and resolution, in the configured chunk format
+    Binary chunks are mapped directly into the model without decoding or copying
+    :param modes: if given, the model only gets the first modes POD modes. Binary chunks are then read in two ranged
+    reads (header, then the prefix of the file up to the last needed mode), so the unused modes are never downloaded
+    :return: ChunkModel, or None if the chunk does not exist
+    """
+    if CHUNK_FORMAT == "binary":
+        path = chunk_store.chunk_path(cell, resolution, "chunk")
+        try:
+            data = store.read(path, None if modes is None else chunk_format.HEADER_SIZE)
+            if modes is not None and len(data) < chunk_format.prefix_size(data, modes):
+                data = store.read(path, chunk_format.prefix_size(data, modes))
+        except ValueError:
+            raise #invalid chunk file
+        except Exception as e:
+            return None
+        return chunk_format.read_chunk(data, modes)
+    df = retrieve_df(cell, resolution, modes)
+    if df is None:
+        return None
+    return chunk_model.from_df(df)
+
 def retrieve_pickle(path_in_bucket):
     """
     Retrieve a pickled object from cloud storage
@@ -48,27 +85,41 @@ def retrieve_pickle(path_in_bucket):
     :return: pandas dataframe
     """
     try:
-        res = download_file_bytes(bucket, path_in_bucket)
-        res = pickle.loads(res.read())
+        res = store.read(path_in_bucket)
+        res = pickle.loads(res)
         return res
     except Exception as e:
         return None
 
 
+def retrieve_cell_index(path_in_bucket):
+    """
+    Retrieve the index of the cells that have a chunk for a resolution (see utils.cell_index)
+    :param path_in_bucket: path of the index file inside bucket
+    :return: sorted numpy array of uint64 cell ids, or None if there is no index for the resolution
+    """
+    try:
+        data = store.read(path_in_bucket)
+    except Exception as e:
+        return None
+    return cell_index.from_bytes(data)
+
 
-def download_file_bytes(bucket, file_name):
+def retrieve_manifest():
     """
-    Helper function to downfloat Bytes from a given blob
+    Retrieve the model manifest (see utils.manifest)
+    :return: Manifest, or None if the bucket has no manifest
+    :raises ValueError: if the manifest file is invalid
     """
-    blob = bucket.blob(file_name)
-    downloaded_bytes = blob.download_as_bytes(retry=custom_retry)
-    return io.BytesIO(downloaded_bytes)
+    try:
+        data = store.read(manifest.manifest_path)
+    except Exception as e:
+        return None
+    return manifest.from_bytes(data)
+
 
 def list_dir(path):
     """
     Helper function to list files inside a directory
     """
-    blobs = bucket.list_blobs(prefix=path)
-    return [blob.name for blob in blobs]
-
-
+    return store.list(path)
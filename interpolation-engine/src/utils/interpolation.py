@@ -30,7 +30,7 @@ def interpolate(df, A, WDref, newWD, newWS, compression_type="float16"):
     wdPredict = np.float_(newWD)
     wsPredict = np.float_(newWS)
 
-    AInterp = np.zeros(len(WDref))
+    AInterp = np.zeros(len(A))
     for i in range(len(A)):
         AInterp[i] = np.interp(wdPredict, WDref, A[i, :])  # Interpolation of new POD coefficients
 
@@ -46,4 +46,218 @@ def interpolate(df, A, WDref, newWD, newWS, compression_type="float16"):
     df["u"] = pd.Series(Ux_Interp)
     df["v"] = pd.Series(Uy_Interp)
     df["w"] = pd.Series(Uz_Interp)
-    del U_Interp, Ux_Interp, Uy_Interp, Uz_Interp
\ No newline at end of file
+    del U_Interp, Ux_Interp, Uy_Interp, Uz_Interp
+
+def interpolate_model(model, A, WDref, newWD, newWS, compression_type="float16"):
+    """
+    Interpolate the datapoints of a decoded chunk model for a new wind direction and speed using POD interpolation
+    Same math as interpolate(), but works on the arrays of a utils.chunk_model.ChunkModel instead of a dataframe
+
+    :param model: ChunkModel with the point-specific interpolation parameters
+    :param A: another interpolation parameter created by model_generation.generate, given as numpy array
+    :param WDref: another interpolation parameter created by model_generation.generate, given as numpy array
+    :param newWD: new wind direction in degrees
+    :param newWS: new wind speed in m/s
+    :param compression_type: datatype to which the interpolated wind components will be compressed to
+    :return: u, v and w as numpy arrays with one value per datapoint
+    """
+    AInterp = interpolate_coefficients(A, WDref, newWD)
+    U_Interp = ((np.dot(model.Psi, AInterp) + model.means) * np.float_(newWS))  # add mean and multiply Uref to get the new wind field
+    Ux_Interp, Uy_Interp, Uz_Interp = np.split(U_Interp.astype(compression_type), 3)  # extract wind speed components
+    return Ux_Interp, Uy_Interp, Uz_Interp
+
+
+def interpolate_fused_models(models, AInterp, newWS, max_stack_bytes=8 * 1024 * 1024):
+    """
+    Interpolate the datapoints of multiple chunk models of the same resolution at once with the fused float32 kernel
+    The mode-major float16 Psi matrices of the chunks are stacked side by side as float32, so that a whole group of
+    chunks is computed with a single matrix-vector product instead of a mode by mode accumulation per chunk
+    ==> a batch of small chunks costs a few products instead of one python loop over the modes per chunk
+    float32 Psi is multiplied per chunk with interpolate_fused(), which is already a single product without any copy of
+    Psi. Stacking it would copy all of Psi first, which takes longer than the products themselves
+
+    :param models: list of ChunkModels
+    :param AInterp: interpolated POD coefficients, see interpolate_coefficients(). Only the first len(AInterp) modes of
+    the models are used
+    :param newWS: new wind speed in m/s
+    :param max_stack_bytes: upper bound for the size of one stacked float32 Psi, larger batches are split into groups
+    :return: list with the u, v and w float32 arrays for each model, in the same order as the models
+    """
+    if len(models) <= 1 or all(model.Psi.dtype == np.float32 for model in models):
+        return [interpolate_fused(model, AInterp, newWS) for model in models]
+    k = len(AInterp)
+    coefficients = np.asarray(AInterp, dtype="float32")
+    results = []
+    group, group_bytes = [], 0
+    for i, model in enumerate(models):
+        group.append(model)
+        group_bytes = group_bytes + 4 * k * 3 * len(model)
+        if group_bytes < max_stack_bytes and i < len(models) - 1:
+            continue
+        PsiT = np.concatenate([model.Psi.T[:k] for model in group], axis=1, dtype="float32") # modes x sum(3N)
+        out = np.dot(coefficients, PsiT)
+        del PsiT
+        np.add(out, np.concatenate([model.means for model in group], dtype="float32"), out=out)
+        out *= np.float32(newWS)
+
+        #split the stacked result back into the individual chunks and their wind components
+        #every chunk gets its own copy, so a cached result does not keep the buffer of the whole group alive
+        offsets = np.cumsum([3 * len(model) for model in group])[:-1]
+        results.extend(tuple(np.split(U_chunk.copy(), 3)) for U_chunk in np.split(out, offsets))
+        group, group_bytes = [], 0
+    return results
+
+
+def interpolate_fused(model, AInterp, newWS, magnitude=False):
+    """
+    Interpolate the datapoints of a chunk model directly into float32 output buffers
+    Same math as interpolate_model(), but without float64 intermediates, without a float16 round trip and without
+    temporary copies of the 3N result:
+    - float32 Psi is multiplied with a single matrix-vector product straight into the output buffer, means and wind
+      speed are applied in place
+    - float16 Psi is accumulated mode by mode into the output buffer, each mode is one contiguous row of the
+      mode-major Psi (see ChunkModel), so float16 is never converted as a whole. The wind speed is folded into the
+      means and the POD coefficients, so the result needs no extra pass for it
+
+    :param model: ChunkModel with the point-specific interpolation parameters
+    :param AInterp: interpolated POD coefficients, see interpolate_coefficients(). Only the first len(AInterp) modes of
+    the model are used, so passing the coefficients of the top-k modes serves a rank-truncated field
+    :param newWS: new wind speed in m/s
+    :param magnitude: if set, the wind speed of each datapoint is computed as well
+    :return: u, v and w (and the magnitude if requested) as float32 numpy arrays with one value per datapoint.
+    u, v and w are views on a single 3N buffer
+    """
+    PsiT = model.Psi.T[:len(AInterp)] # mode-major (modes x 3N), a prefix of the modes stays contiguous
+    ws = np.float32(newWS)
+    out = np.empty(PsiT.shape[1], dtype="float32")
+    if PsiT.dtype == np.float32 and PsiT.flags.c_contiguous:
+        np.dot(np.asarray(AInterp, dtype="float32"), PsiT, out=out)
+        np.add(out, model.means, out=out, dtype="float32")
+        out *= ws
+    else:
+        coefficients = (np.asarray(AInterp) * np.float_(newWS)).astype("float32")
+        np.multiply(model.means, ws, out=out, dtype="float32")
+        work = np.empty_like(out)
+        for i in np.flatnonzero(coefficients):
+            np.multiply(PsiT[i], coefficients[i], out=work, dtype="float32")
+            out += work
+    Ux_Interp, Uy_Interp, Uz_Interp = np.split(out, 3)  # views, no copies
+    if not magnitude:
+        return Ux_Interp, Uy_Interp, Uz_Interp
+    speed = np.hypot(Ux_Interp, Uy_Interp)
+    np.hypot(speed, Uz_Interp, out=speed)
+    return Ux_Interp, Uy_Interp, Uz_Interp, speed
+
+
+def interpolate_coefficients(A, WDref, newWD):
+    """
+    Interpolate the POD coefficients linearly between the reference directions
+    :return: AInterp as numpy array with one coefficient per mode
+    """
+    wdPredict = np.float_(newWD)
+    AInterp = np.zeros(len(A))
+    for i in range(len(A)):
+        AInterp[i] = np.interp(wdPredict, WDref, A[i, :])  # Interpolation of new POD coefficients
+    return AInterp
+
+
+def mode_energy(A):
+    """
+    Share of the total energy that each POD mode captures
+    A = diag(Sig) R with orthonormal rows in R, so the squared norm of each row of A is the squared singular value of its mode
+    ==> same values as model_generation.mode_energy, for models without recorded energies
+    :param A: interpolation parameter created by model_generation.generate (modes x reference directions)
+    :return: numpy array with one energy share per mode
+    """
+    energy = np.square(np.asarray(A, dtype="float64")).sum(axis=1)
+    return energy / energy.sum()
+
+
+def modes_for_budget(energy, budget):
+    """
+    Find the smallest number of leading POD modes whose discarded energy stays within an error budget
+    The modes are sorted by energy, so the error of serving only the first k modes is the energy of the others
+    :param energy: energy share of each mode, see mode_energy()
+    :param budget: share of the total energy that may be discarded (0 keeps all modes)
+    :return: number of modes k, at least 1
+    """
+    energy = np.asarray(energy, dtype="float64")
+    #discarded[k] is the energy of all modes from k on
+    discarded = np.append(np.cumsum(energy[::-1])[::-1], 0.0) / energy.sum()
+    return max(1, int(np.argmax(discarded <= budget + 1e-12)))
+
+
+def parse_error_budgets(value):
+    """
+    Parse the configured error budgets of the POD modes
+    :param value: one budget for all resolutions ("0.001"), or budgets per resolution ("4:0.001,32:0.01"), which can be
+    combined with a default for the other resolutions ("0.0001,32:0.01")
+    :return: dict from resolution to budget, the default is stored under None
+    """
+    budgets = {}
+    for entry in value.split(","):
+        if entry.strip():
+            resolution, _, budget = entry.rpartition(":")
+            budgets[int(resolution) if resolution else None] = float(budget)
+    return budgets
+
+
+def direction_weights(WDref, newWD):
+    """
+    Compute the weight of each reference direction in the linear interpolation at a new wind direction
+    np.interp is linear in its fp argument, so interpolating the unit vectors yields weights with
+    np.interp(newWD, WDref, a) == np.dot(weights, a) for any a. At most 2 of the weights are non-zero
+    :param WDref: interpolation parameter created by model_generation.generate, given as numpy array
+    :param newWD: new wind direction in degrees
+    :return: numpy array with one weight per reference direction
+    """
+    return np.array([np.interp(np.float_(newWD), WDref, e) for e in np.eye(len(WDref))])
+
+
+def interpolate_basis(model, WDref, newWD, newWS, compression_type="float16"):
+    """
+    Interpolate the datapoints of a chunk model with a precomputed basis (see chunk_model.precompute_basis)
+    Gives the same result as interpolate_model(), but blends the two precomputed fields of the neighbouring reference
+    directions instead of multiplying Psi with the interpolated POD coefficients
+
+    :param model: ChunkModel with precomputed basis
+    :param WDref: interpolation parameter created by model_generation.generate, given as numpy array
+    :param newWD: new wind direction in degrees
+    :param newWS: new wind speed in m/s
+    :param compression_type: datatype to which the interpolated wind components will be compressed to
+    :return: u, v and w as numpy arrays with one value per datapoint
+    """
+    weights = direction_weights(WDref, newWD) * np.float_(newWS)  # fold the wind speed into the blend weights
+    U_Interp = np.zeros(model.basis.shape[1], dtype="float32")
+    for i in np.flatnonzero(weights):
+        U_Interp += model.basis[i] * np.float32(weights[i])
+    Ux_Interp, Uy_Interp, Uz_Interp = np.split(U_Interp.astype(compression_type), 3)  # extract wind speed components
+    return Ux_Interp, Uy_Interp, Uz_Interp
+
+
+class ScalableResult:
+    """
+    Interpolated wind field of a chunk for a wind direction at a wind speed of 1 m/s
+    The interpolated field is linear in the wind speed, so the field for any wind speed is the unscaled field times
+    the wind speed. Scaled fields are not kept, so the size of a cached result never changes after it was put
+    ==> every request scales the field again, which is one multiplication per component
+    """
+
+    def __init__(self, u, v, w):
+        self.unscaled = (u, v, w)
+        self.ws = None
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.unscaled)
+
+    def scale(self, newWS):
+        """
+        Get the wind field for a wind speed
+        :param newWS: wind speed in m/s
+        :return: (u, v, w as float32 numpy arrays, True if the previous request was for the same wind speed)
+        """
+        exact = self.ws == newWS
+        self.ws = newWS
+        ws = np.float32(newWS)
+        return tuple(np.multiply(c, ws, dtype="float32") for c in self.unscaled), exact
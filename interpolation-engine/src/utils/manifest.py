@@ -0,0 +1,103 @@
+"""
+Model manifest: one small file in the bucket (metadata/manifest.json) that describes the deployed POD model
+
+{
+    "model_version": "2024-07-01",
+    "resolutions": {
+        "4": {"chunks": 1234, "A": "metadata/4_A.pickle", "WDref": "metadata/4_WDref.pickle", "cells": "metadata/4_cells.npy",
+              "energy": [0.71, 0.12, ...], "points": 20000},
+        ...
+    }
+}
+
+Everything except model_version and the resolutions is optional, missing file locations default to the usual
+paths in metadata/. energy is the share of the total energy per POD mode, without it the engine derives it from A. points is the mean number of datapoints per chunk
+The manifest must be uploaded last when rolling out a new model, as the engine switches to the new model version
+as soon as it sees the new manifest
+"""
+import json
+
+from utils import cell_index
+
+manifest_path = "metadata/manifest.json"
+
+
+class Manifest:
+    """
+    Parsed model manifest
+    """
+
+    def __init__(self, model_version, resolutions):
+        """
+        :param model_version: version of the POD model, part of all cache keys
+        :param resolutions: dict from resolution to dict with the optional keys chunks, A, WDref, cells, energy and points
+        """
+        self.model_version = str(model_version)
+        self.resolutions = resolutions
+
+    def files(self, resolution):
+        """
+        Get the locations of the metadata files of a resolution
+        Resolutions that are not in the manifest get the default locations, so that they fail like missing files
+        :return: dict with the paths of A, WDref and the cell index (cells)
+        """
+        entry = self.resolutions.get(resolution, {})
+        return {
+            "A": entry.get("A", f"metadata/{resolution}_A.pickle"),
+            "WDref": entry.get("WDref", f"metadata/{resolution}_WDref.pickle"),
+            "cells": entry.get("cells", cell_index.index_path(resolution))
+        }
+
+    def energy(self, resolution):
+        """
+        :return: energy share of each POD mode of the resolution as a list, or None if the manifest does not have it
+        """
+        return self.resolutions.get(resolution, {}).get("energy")
+
+    def points(self, resolution):
+        """
+        :return: mean number of datapoints per chunk of the resolution, or None if the manifest does not have it
+        """
+        return self.resolutions.get(resolution, {}).get("points")
+
+    def to_dict(self):
+        """
+        :return: manifest in the same structure as the manifest file
+        """
+        return {
+            "model_version": self.model_version,
+            "resolutions": {str(resolution): {"chunks": entry.get("chunks"), **self.files(resolution),
+                                              "energy": entry.get("energy"), "points": entry.get("points")}
+                            for resolution, entry in sorted(self.resolutions.items())}
+        }
+
+
+def from_bytes(data):
+    """
+    Parse a manifest file
+    :param data: bytes-like object with the content of the manifest file
+    :return: Manifest
+    :raises ValueError: if the file is not a valid manifest
+    """
+    try:
+        content = json.loads(bytes(data))
+        resolutions = {int(resolution): dict(entry) for resolution, entry in content["resolutions"].items()}
+        return Manifest(content["model_version"], resolutions)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError("Invalid manifest") from e
+
+
+def from_listing(model_version, names):
+    """
+    Create a manifest from the file names in metadata/, for buckets without a manifest file
+    :param model_version: version of the POD model (from the environment)
+    :param names: paths of the files in metadata/
+    :return: Manifest with all resolutions that have an A matrix
+    """
+    resolutions = {}
+    for name in names:
+        file_name = name.split("/")[-1]
+        prefix, _, suffix = file_name.partition("_")
+        if suffix == "A.pickle" and prefix.isdigit():
+            resolutions[int(prefix)] = {}
+    return Manifest(model_version, resolutions)
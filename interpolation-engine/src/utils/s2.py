@@ -1,9 +1,21 @@
+import math
+import os
+from functools import lru_cache
+
 import s2geometry as s2g
+from utils import cell_index
 from models import InputPolygonFeature, OutputPolygonFeature, Covering, PolygonGeometry, CellProperties, SensorDataProperties
 
 max_precision = 22
 bit_overhead = 64-4 - (max_precision*2)
 resolution_to_cell_level = {1 : 17, 2 : 16, 4 : 15, 8 : 14, 16 : 13, 32 : 12}
+cell_level_to_resolution = {level : resolution for resolution, level in resolution_to_cell_level.items()}
+earth_radius = 6371010.0 #meters
+#distance-adaptive coverings use the finest resolution up to this many cell widths of it away from the camera,
+#every doubling of the distance beyond that halves the resolution
+detail_cells = float(os.getenv("COVERING_DETAIL_CELLS", 8))
+#number of cell features kept in memory, a cell id also encodes its level ==> one cache for all resolutions
+feature_cache_size = int(os.getenv("COVERING_FEATURE_CACHE_SIZE", 100000))
 
 
 def encode_index(lat, lng, precision=max_precision):
@@ -28,23 +40,145 @@ def index_to_query_range(cell_id):
     lsb = cell_id & -cell_id
     return cell_id-lsb, cell_id+lsb
 
-def compute_covering(input_polygon, resolution, sensor_data):
+
+def cells_to_covering(cell_ids, sensor_data):
     """
-    Computes the S2 covering for a given input polygon and resolution
+    Create the GeoJSON covering for given cells
+    :param cell_ids: list of cell ids as integers, may be of different levels
     :param sensor_data: sensor_data to be included in the properties
     :return: S2 covering
     """
-    polygon = parse_polygon(input_polygon)
-    coverer = get_region_coverer(resolution)
-    covering = coverer.GetCovering(polygon)
-    features = []
-    for cell_id in covering:
-        features.append(cell_to_feature(cell_id))
+    features = [cell_to_feature(cell_id) for cell_id in cell_ids]
+    #the features were generated by the server itself ==> no need to validate them again
     properties = SensorDataProperties(sensor_data=sensor_data)
-    result = Covering(properties=properties, features=features)
+    result = Covering.model_construct(properties=properties, features=features)
     return result
 
 
+def compute_covering_ids(input_polygon, resolution, index=None):
+    """
+    Computes only the cell ids of the S2 covering for a given input polygon and resolution, without any geometry
+    :param index: optional cell index (see utils.cell_index), cells without a chunk are left out
+    :return: list of cell ids as integers
+    """
+    polygon = parse_polygon(input_polygon)
+    coverer = get_region_coverer(resolution)
+    cells = [cell_id.id() for cell_id in coverer.GetCovering(polygon)]
+    return cell_index.filter_cells(index, cells)
+
+
+def compute_adaptive_covering_ids(input_polygon, resolution, camera, indexes=None, max_cells=None, max_points=None, points_per_cell=None):
+    """
+    Computes a covering with cells of multiple resolutions, fine near the camera and coarse far away from it
+    Starts from the covering at the coarsest resolution and splits the cells into their children as long as they are
+    closer to the camera than their resolution allows (see target_resolution). Children that do not touch the polygon
+    are dropped
+    If the covering exceeds the budget, the detail distance is halved (==> every cell gets one resolution coarser) until
+    it fits. If even the coarsest covering does not fit, the cells farthest from the camera are left out
+    :param resolution: finest resolution, used next to the camera
+    :param camera: (longitude, latitude) of the camera position on the ground, or of the middle of the near edge of the view
+    :param indexes: optional dict from resolution to cell index (see utils.cell_index), cells without a chunk are
+    left out. Only the resolutions in the dict are used if given
+    :param max_cells: maximum number of cells, or None
+    :param max_points: maximum number of datapoints, or None
+    :param points_per_cell: dict from resolution to the estimated number of datapoints per chunk, needed for max_points
+    :return: list of (cell id, resolution), nearest cells first
+    """
+    resolutions = [r for r in sorted(resolution_to_cell_level) if r >= resolution and (indexes is None or r in indexes)]
+    if resolution not in resolution_to_cell_level or not resolutions:
+        raise ValueError("Invalid resolution")
+    polygon = parse_polygon(input_polygon)
+    camera = s2g.S2LatLng.FromDegrees(camera[1], camera[0])
+    coarsest = resolutions[-1]
+    roots = [(cell_id, cell_distance(camera, cell_id)) for cell_id in get_region_coverer(coarsest).GetCovering(polygon)]
+    if not roots:
+        return []
+    #the finest resolution is used from the nearest cell on, at least for detail_cells widths of its cells
+    finest_width = cell_width(s2g.S2CellId(camera).parent(resolution_to_cell_level[resolution]))
+    detail_distance = max(min(distance for _, distance in roots), detail_cells * finest_width)
+
+    for _ in range(len(resolutions)):
+        cells = []
+        for cell_id, distance in roots:
+            refine_cell(polygon, camera, cell_id, distance, resolutions, detail_distance, cells)
+        cells = [cell for cell in cells if indexes is None or indexes[cell[1]] is None or
+                 cell_index.contains(indexes[cell[1]], [cell[0]])[0]]
+        if cells_within_budget(cells, max_cells, max_points, points_per_cell) == len(cells):
+            break
+        detail_distance = detail_distance / 2
+
+    cells.sort(key=lambda cell: cell[2])
+    cells = cells[:cells_within_budget(cells, max_cells, max_points, points_per_cell)]
+    return [(cell, cell_resolution) for cell, cell_resolution, _ in cells]
+
+
+def refine_cell(polygon, camera, cell_id, distance, resolutions, detail_distance, cells):
+    """
+    Helper function to split a cell of an adaptive covering into its children, until they are coarse enough for their distance
+    Levels whose resolution is not in resolutions are split further, so only available resolutions end up in the covering
+    :param distance: distance of the cell from the camera in meters
+    :param cells: list to which the cells of the covering are added as (cell id, resolution, distance)
+    """
+    resolution = cell_level_to_resolution[cell_id.level()]
+    if resolution in resolutions and resolution <= target_resolution(distance, resolutions, detail_distance):
+        cells.append((cell_id.id(), resolution, distance))
+        return
+    for i in range(4):
+        child = cell_id.child(i)
+        if polygon.MayIntersect(s2g.S2Cell(child)):
+            refine_cell(polygon, camera, child, cell_distance(camera, child), resolutions, detail_distance, cells)
+
+
+def target_resolution(distance, resolutions, detail_distance):
+    """
+    Coarsest resolution that is still detailed enough at a distance from the camera
+    The projected size of a cell shrinks with its distance ==> every doubling of the distance beyond the detail
+    distance allows cells of twice the size
+    :param resolutions: available resolutions, sorted from fine to coarse
+    :return: resolution
+    """
+    steps = int(math.floor(math.log2(max(distance, detail_distance) / detail_distance)))
+    target = resolutions[0] * 2 ** steps
+    return max([r for r in resolutions if r <= target], default=resolutions[0])
+
+
+def cells_within_budget(cells, max_cells, max_points, points_per_cell):
+    """
+    Count the leading cells of a covering that stay within a cell and point budget
+    Resolutions without an estimate of their datapoints per chunk do not count towards the point budget
+    :param cells: list of (cell id, resolution, ...)
+    :return: number of cells
+    """
+    count = len(cells) if max_cells is None else min(len(cells), max_cells)
+    if max_points is None or not points_per_cell:
+        return count
+    points = 0
+    for i, cell in enumerate(cells[:count]):
+        points = points + (points_per_cell.get(cell[1]) or 0)
+        if points > max_points:
+            return i
+    return count
+
+
+def cell_distance(camera, cell_id):
+    """
+    Approximate distance between the camera and the nearest point of a cell (0 if the camera is inside the cell)
+    :param camera: S2LatLng of the camera
+    :return: distance in meters
+    """
+    center = camera.GetDistance(cell_id.ToLatLng()).radians() * earth_radius
+    return max(0.0, center - cell_width(cell_id) / 2)
+
+
+def cell_width(cell_id):
+    """
+    Length of the diagonal of a cell, which is the largest distance between two of its points
+    :return: length in meters
+    """
+    cell = s2g.S2Cell(cell_id)
+    return s2g.S2LatLng(cell.GetVertex(0)).GetDistance(s2g.S2LatLng(cell.GetVertex(2))).radians() * earth_radius
+
+
 def parse_polygon(gjson : InputPolygonFeature):
     """
     Parse the input geojson polygon to an S2 Polygon
@@ -58,20 +192,24 @@ def parse_polygon(gjson : InputPolygonFeature):
 
     return polygon
 
+@lru_cache(maxsize=feature_cache_size)
 def cell_to_feature(cell_id):
     """
     Create geojson feature for a given cell id
+    Cell boundaries never change, so features are cached per cell id and shared between responses (do not modify them)
+    The models are constructed without validation, as the geometry of S2 cells is valid by construction
+    :param cell_id: cell id as integer
     """
-    cell = s2g.S2Cell(cell_id)
+    cell = s2g.S2Cell(s2g.S2CellId(cell_id))
     def vertex_to_lat_lng(i):
         latlng = s2g.S2LatLng(cell.GetVertex(i))
         return latlng.lng().degrees(), latlng.lat().degrees()
 
     cell_vertices = list(([[vertex_to_lat_lng(i) for i in range(4)]]))
     cell_vertices[0].append(cell_vertices[0][0])
-    properties = CellProperties(cell=str(cell_id.id()))
-    geometry = PolygonGeometry(coordinates=cell_vertices)
-    return OutputPolygonFeature(geometry=geometry, properties=properties)
+    properties = CellProperties.model_construct(cell=str(cell_id), resolution=cell_level_to_resolution.get(s2g.S2CellId(cell_id).level()))
+    geometry = PolygonGeometry.model_construct(coordinates=cell_vertices)
+    return OutputPolygonFeature.model_construct(geometry=geometry, properties=properties)
 
 def get_region_coverer(resolution):
     """
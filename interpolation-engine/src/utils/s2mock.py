@@ -2,15 +2,29 @@
 This file only exists for testing purposes on systems that cant install s2geometry
 """
 from models import Covering
+from utils import cell_index
 
 
 
-def compute_covering(request, resolution, meta):
+def compute_covering_ids(request, resolution, index=None):
+    cells = [int(feature.properties.cell) for feature in Covering.parse_raw(mock_response).features]
+    return cell_index.filter_cells(index, cells)
+
+
+def cells_to_covering(cell_ids, meta):
     response = Covering.parse_raw(mock_response)
     response.properties.sensor_data = meta
+    features = {int(feature.properties.cell): feature for feature in response.features}
+    response.features = [features[cell] for cell in cell_ids if cell in features]
     return response
 
 
+def compute_adaptive_covering_ids(request, resolution, camera, indexes=None, max_cells=None, max_points=None, points_per_cell=None):
+    #no geometry without s2geometry ==> all mock cells at the finest resolution
+    cells = compute_covering_ids(request, resolution, None if indexes is None else indexes.get(resolution))
+    return [(cell, resolution) for cell in cells[:max_cells]]
+
+
 
 mock_response = '''{
     "type": "FeatureCollection",
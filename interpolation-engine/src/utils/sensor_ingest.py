@@ -0,0 +1,111 @@
+"""
+Readers for the latest wind sensor readings in the sensor database
+
+Modes (SENSOR_INGEST_MODE):
+- incremental: only fetches rows that are newer than the last reading, with only the columns of the wind sensors
+  ==> while there is no new reading, each query returns nothing. The columns are discovered once with a full query (default)
+- poll: fetches the whole table with every query (the original behavior, kept as a fallback)
+
+Postgres LISTEN/NOTIFY is not used: pg8000 (behind the Cloud SQL connector) only receives notifications together with the
+result of the next statement, so the daemon would still need one round trip per check
+"""
+from abc import ABC, abstractmethod
+
+from sqlalchemy import text
+
+sensor_table = '"public"."sensors-to-cloud-data"'
+timestamp_column = "TIMESTAMP"
+ignored_sensors = ["ILR"]
+
+
+def sensor_columns(columns):
+    """
+    Find the wind sensors in the columns of the sensor table
+    :param columns: column names of the sensor table
+    :return: dict from sensor id to the names of its wind speed and wind direction columns
+    """
+    sensors = {}
+    for column in columns:
+        if not column.endswith("_ms"):
+            continue
+        sensor_id = column.split("_")[0]
+        if sensor_id not in ignored_sensors:
+            sensors[sensor_id] = (f"{sensor_id}_RAW_CV50_Wind_ms", f"{sensor_id}_RAW_CV50_WindDirection_deg")
+    return sensors
+
+
+def to_readings(row, sensors):
+    """
+    Extract the readings of all sensors from a row of the sensor table
+    :return: timestamp of the row, dict from sensor id to (ws, wd)
+    """
+    return row[timestamp_column], {sensor_id: (float(row[ws]), float(row[wd])) for sensor_id, (ws, wd) in sensors.items()}
+
+
+class SensorReader(ABC):
+    """
+    Interface for reading the latest row of the sensor table
+    """
+
+    @abstractmethod
+    def read(self, conn):
+        """
+        Read the latest readings
+        :param conn: sqlalchemy connection to the sensor database
+        :return: (timestamp, dict from sensor id to (ws, wd)), or None if there is no new row
+        """
+
+
+class FullTableReader(SensorReader):
+    """
+    Reads the whole sensor table and uses its first row
+    """
+
+    def read(self, conn):
+        result = conn.execute(text(f"SELECT * FROM {sensor_table}"))
+        row = result.mappings().first()
+        if row is None:
+            return None
+        return to_readings(row, sensor_columns(result.keys()))
+
+
+class IncrementalReader(SensorReader):
+    """
+    Reads only rows that are newer than the last reading, and only the columns of the wind sensors
+    The first read fetches the newest row with all columns to discover the sensors
+    """
+
+    def __init__(self):
+        self.sensors = None
+        self.last = None
+
+    def read(self, conn):
+        if self.sensors is None:
+            result = conn.execute(text(f'SELECT * FROM {sensor_table} ORDER BY "{timestamp_column}" DESC LIMIT 1'))
+            row = result.mappings().first()
+            if row is None:
+                return None
+            self.sensors = sensor_columns(result.keys())
+        else:
+            columns = [timestamp_column] + [column for pair in self.sensors.values() for column in pair]
+            projection = ", ".join(f'"{column}"' for column in columns)
+            query = (f'SELECT {projection} FROM {sensor_table} '
+                     f'WHERE "{timestamp_column}" > :last ORDER BY "{timestamp_column}" DESC LIMIT 1')
+            row = conn.execute(text(query), {"last": self.last}).mappings().first()
+            if row is None:
+                return None
+        self.last = row[timestamp_column]
+        return to_readings(row, self.sensors)
+
+
+def make_reader(mode):
+    """
+    Create the reader for an ingestion mode
+    :param mode: "incremental" or "poll"
+    :return: SensorReader
+    """
+    if mode == "poll":
+        return FullTableReader()
+    if mode == "incremental":
+        return IncrementalReader()
+    raise ValueError(f"Unknown sensor ingestion mode {mode}")
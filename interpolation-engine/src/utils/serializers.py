@@ -1,13 +1,204 @@
 import io
+import struct
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-def df_to_parquet(df):
+#Response encodings that can be negotiated with the client and their media types
+media_types = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "raw": "application/x-wind-columns"
+}
+
+#Header of the raw columnar encoding: magic, version, number of columns, number of rows
+raw_header = struct.Struct("<4sBBxxI")
+#Descriptor of each column in the raw encoding: name, kind of numbers ("f", "i" or "u"), bytes per value
+raw_column = struct.Struct("<6scB")
+raw_alignment = 8
+#Columns that depend on the wind reading, all others are static for a chunk
+wind_columns = ["u", "v", "w"]
+
+
+def encode_static(encoding, static, wind_type):
+    """
+    Pre-encode the static columns of a frame, which do not depend on the wind reading (coordinates and cell id)
+    The result can be cached and combined with freshly interpolated wind columns in encode_frames
+    :param encoding: name of the encoding (key of media_types)
+    :param static: dict from column name to numpy array
+    :param wind_type: numpy dtype of the wind columns that will be combined with the static columns
+    :return: for raw, the bytes of the message up to the wind columns. Otherwise, the column names and Arrow arrays
+    """
+    if encoding == "raw":
+        n_rows = len(next(iter(static.values())))
+        columns = [(name, array.dtype) for name, array in static.items()] + [(name, np.dtype(wind_type)) for name in wind_columns]
+        parts = [raw_header.pack(b"WRAW", 1, len(columns), n_rows)]
+        for name, dtype in columns:
+            parts.append(raw_column.pack(name.encode("ascii"), dtype.kind.encode("ascii"), dtype.itemsize))
+        parts.append(b"\0" * (-(raw_header.size + raw_column.size * len(columns)) % raw_alignment))
+        for array in static.values():
+            parts.append(to_raw_column(array))
+        return b"".join(parts)
+    return list(static.keys()), [pa.array(array) for array in static.values()]
+
+
+def encoded_size(encoded):
     """
-    Simple helper function to convert pandas dataframe to an in-memory parquet file
-    :param df: pandas dataframe
+    Size of pre-encoded static columns in bytes, used for caching
+    """
+    if isinstance(encoded, bytes):
+        return len(encoded)
+    return sum(array.nbytes for array in encoded[1])
+
+
+def to_raw_column(array):
+    """
+    Helper function to encode a single column in the raw encoding, including its padding
+    """
+    data = array.astype(array.dtype.newbyteorder("<"), copy=False).tobytes()
+    return data + b"\0" * (-len(data) % raw_alignment)
+
+
+def to_record_batch(frame):
+    """
+    Helper function to combine the pre-encoded static Arrow arrays and the wind columns of a frame to a record batch
+    """
+    (names, arrays), wind = frame
+    return pa.RecordBatch.from_arrays(arrays + [pa.array(array) for array in wind.values()], names=names + list(wind.keys()))
+
+
+def frames_to_parquet(frames):
+    """
+    Encode frames as a parquet file, with one row group per frame
+    :param frames: non-empty list of frames, each a tuple of the pre-encoded static columns and a dict from wind column name to numpy array
     :return: parquet file as bytes
     """
     buffer = io.BytesIO()
-    df.to_parquet(buffer, engine='pyarrow')
-    buffer.seek(0)
+    tables = [pa.Table.from_batches([to_record_batch(frame)]) for frame in frames]
+    with pq.ParquetWriter(buffer, tables[0].schema) as writer:
+        for table in tables:
+            writer.write_table(table)
     return buffer.getvalue()
+
+
+def frames_to_arrow(frames):
+    """
+    Encode frames as an Arrow IPC stream, with one record batch per frame
+    The record batches are built directly on the numpy buffers, without a dataframe
+    :param frames: non-empty list of frames, each a tuple of the pre-encoded static columns and a dict from wind column name to numpy array
+    :return: Arrow IPC stream as bytes
+    """
+    batches = [to_record_batch(frame) for frame in frames]
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batches[0].schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def frames_to_raw(frames):
+    """
+    Encode frames in the raw little-endian columnar encoding, with one message per frame
+
+    Each message consists of
+        header          magic "WRAW", version (uint8), number of columns (uint8), 2 bytes padding, number of rows (uint32)
+        descriptors     one per column: name (6 bytes ascii, zero-padded), kind of numbers (1 byte "f", "i" or "u"),
+                        bytes per value (uint8)
+        columns         the values of each column, one column after the other
+    The descriptors and every column are zero-padded to a multiple of 8 bytes, so all columns are aligned
+    :param frames: non-empty list of frames, each a tuple of the pre-encoded static columns and a dict from wind column name to numpy array
+    :return: raw messages as bytes
+    """
+    parts = []
+    for static, wind in frames:
+        parts.append(static)
+        for array in wind.values():
+            parts.append(to_raw_column(array))
+    return b"".join(parts)
+
+
+encoders = {
+    "parquet": frames_to_parquet,
+    "arrow": frames_to_arrow,
+    "raw": frames_to_raw
+}
+
+
+class RawStreamEncoder:
+    """
+    Encodes frames incrementally for streamed responses in the raw encoding
+    Raw messages are self-delimiting, so the stream is just the concatenation of the messages
+    """
+
+    def encode(self, frames):
+        """
+        :param frames: list of frames, see frames_to_raw
+        :return: bytes to send for the frames
+        """
+        return frames_to_raw(frames) if frames else b""
+
+    def close(self):
+        """
+        :return: bytes to send at the end of the stream
+        """
+        return b""
+
+
+class ArrowStreamEncoder:
+    """
+    Encodes frames incrementally as one Arrow IPC stream, for streamed responses
+    The schema is sent with the first frame, every frame is one record batch
+    """
+
+    def __init__(self):
+        self.sink = io.BytesIO()
+        self.writer = None
+
+    def encode(self, frames):
+        for frame in frames:
+            batch = to_record_batch(frame)
+            if self.writer is None:
+                self.writer = pa.ipc.new_stream(self.sink, batch.schema)
+            self.writer.write_batch(batch)
+        return self.take()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        return self.take()
+
+    def take(self):
+        """
+        :return: bytes written since the last call
+        """
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+
+#Encodings that can be streamed frame by frame (parquet needs the whole file for its footer)
+stream_encoders = {
+    "arrow": ArrowStreamEncoder,
+    "raw": RawStreamEncoder
+}
+
+
+def negotiate_encoding(requested_format, accept):
+    """
+    Choose the response encoding for a request
+    An explicitly requested format takes precedence over the Accept header. Parquet is the default
+    :param requested_format: format given as query parameter, or None
+    :param accept: Accept header of the request, or None
+    :return: name of the encoding (key of media_types)
+    """
+    if requested_format is not None:
+        return requested_format
+    if accept:
+        for media_range in accept.split(","):
+            media_type = media_range.split(";")[0].strip()
+            for encoding, encoding_media_type in media_types.items():
+                if media_type == encoding_media_type:
+                    return encoding
+    return "parquet"
@@ -0,0 +1,123 @@
+"""
+Sharing of a small snapshot between the worker processes of one host
+
+- LeaderLock: elects one process per host through an exclusive flock on a lock file. The lock is released by the
+  kernel when the process dies, or by the leader itself when it keeps failing, so another process takes over with its next try
+- SharedSnapshot: memory-mapped file (in /dev/shm by default) that one process writes and all others read, guarded
+  by a seqlock ==> readers never block the writer and never take a lock themselves
+
+Layout of the shared file: sequence number (uint64), payload length (uint32), payload
+The sequence number is odd while the writer is changing the payload, readers retry until they read the same even
+sequence number before and after copying the payload
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+HEADER = struct.Struct("<QI")
+SEQUENCE = struct.Struct("<Q")
+default_directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+class LeaderLock:
+    """
+    Exclusive lock that is held by at most one process of the host
+    A leader that keeps failing gives up the lock (see record), so that a healthy process can take over
+    """
+
+    def __init__(self, path, max_failures=3):
+        """
+        :param path: path of the lock file
+        :param max_failures: number of consecutive failed rounds after which the leader releases the lock
+        """
+        self.path = path
+        self.file = None
+        self.max_failures = max_failures
+        self.failures = 0
+
+    def try_acquire(self):
+        """
+        Try to become the leader, without blocking
+        :return: True if this process holds the lock (also if it held it already)
+        """
+        if self.file is not None:
+            return True
+        file = open(self.path, "a+")
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            return False
+        self.file = file
+        self.failures = 0
+        return True
+
+    def release(self):
+        """
+        Give up the lock, another process becomes the leader with its next try
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def record(self, success):
+        """
+        Record the outcome of a round of the leader
+        :param success: False if the round failed
+        :return: True if the lock was released, as the leader failed max_failures times in a row
+        """
+        self.failures = 0 if success else self.failures + 1
+        if self.failures < self.max_failures:
+            return False
+        self.release()
+        return True
+
+
+class SharedSnapshot:
+    """
+    Single-writer, multi-reader snapshot in a memory-mapped file
+    Only the process that holds the corresponding LeaderLock may publish
+    """
+
+    def __init__(self, path, size=64 * 1024):
+        self.size = size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.buffer = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def publish(self, payload):
+        """
+        Replace the snapshot
+        :param payload: new snapshot as bytes
+        :raises ValueError: if the payload does not fit into the shared file
+        """
+        if len(payload) > self.size - HEADER.size:
+            raise ValueError("Snapshot too large")
+        sequence = SEQUENCE.unpack_from(self.buffer, 0)[0]
+        sequence = sequence + sequence % 2 #a previous writer may have died while writing
+        SEQUENCE.pack_into(self.buffer, 0, sequence + 1)
+        self.buffer[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(self.buffer, 0, sequence + 1, len(payload))
+        SEQUENCE.pack_into(self.buffer, 0, sequence + 2)
+
+    def read(self, retries=100):
+        """
+        Read the current snapshot
+        :return: (sequence number, payload as bytes), the payload is None if nothing was published yet.
+        None if no consistent snapshot could be read, as the writer was busy during all retries
+        """
+        for _ in range(retries):
+            sequence, length = HEADER.unpack_from(self.buffer, 0)
+            if sequence % 2 == 0 and length <= self.size - HEADER.size:
+                payload = self.buffer[HEADER.size:HEADER.size + length]
+                if SEQUENCE.unpack_from(self.buffer, 0)[0] == sequence:
+                    return sequence, payload if sequence > 0 else None
+            time.sleep(0)
+        return None
@@ -0,0 +1,67 @@
+"""
+Coalescing of concurrent identical computations on the event loop
+"""
+import asyncio
+
+
+class SingleFlight:
+    """
+    Runs at most one computation per key at a time
+    Callers that ask for a key while its computation is in flight wait for that computation instead of starting their own
+
+    - All waiters receive the same result, or the same exception if the computation fails
+    - Finished computations are forgotten immediately, so failures are never cached and the next call starts over
+    - A cancelled waiter does not cancel the computation for the other waiters. The computation is only cancelled once
+      all of its waiters were cancelled
+
+    Not thread-safe, must only be used from the event loop
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, function, *args):
+        """
+        Run function(*args) for the key, or join the computation that is already in flight for it
+        :param key: hashable key that identifies the computation
+        :param function: async function to call
+        :return: result of the computation
+        """
+        call = self.calls.get(key)
+        if call is None:
+            call = Call(asyncio.ensure_future(function(*args)))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda _: self.forget(key, call))
+        else:
+            self.coalesced = self.coalesced + 1
+
+        call.waiters = call.waiters + 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters = call.waiters - 1
+            if call.waiters == 0 and not call.task.done():
+                #the last waiter was cancelled, nobody needs the result anymore
+                call.task.cancel()
+                self.forget(key, call)
+
+    def forget(self, key, call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def stats(self):
+        """
+        :return: dict with the number of computations in flight and of calls that joined another computation
+        """
+        return {"in_flight": len(self.calls), "coalesced": self.coalesced}
+
+
+class Call:
+    """
+    Computation in flight and the number of callers waiting for it
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
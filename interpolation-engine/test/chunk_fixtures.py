@@ -0,0 +1,26 @@
+"""
+Synthetic chunks shared by the offline tests and the interpolation benchmark
+"""
+import numpy as np
+import pandas as pd
+
+
+def generate_chunk(n_points, degs, seed=0):
+    """
+    Generate a random chunk dataframe with the same schema as the chunks created by model_generation.generate
+    :param n_points: number of datapoints
+    :param degs: reference wind directions, one POD mode per direction
+    :param seed: seed of the random values
+    :return: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    columns["lat"] = rng.uniform(52.5, 52.6, n_points).astype("float32")
+    columns["lon"] = rng.uniform(13.3, 13.4, n_points).astype("float32")
+    columns["z"] = rng.choice([30, 45, 50], n_points).astype("int16")
+    for c in ["u", "v", "w"]:
+        columns[f"mean_{c}"] = rng.normal(0, 0.1, n_points).astype("float16")
+    for deg in degs:
+        for c in ["u", "v", "w"]:
+            columns[f"{c}_{deg}"] = rng.normal(0, 0.01, n_points).astype("float16")
+    return pd.DataFrame(columns)
@@ -0,0 +1,63 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import unittest
+from utils.cache import SizedCache
+
+
+class DefaultTestCase(unittest.TestCase):
+    #These tests run offline against the cache directly, no running server required
+
+    def setUp(self):
+        #values are bytes and sized by their length, half of the budget is protected
+        self.cache = SizedCache(10, len, protected_share=0.5)
+
+    def keys(self):
+        return list(self.cache.probation) + list(self.cache.protected)
+
+    def test_eviction_order(self): #entries hit only once must be evicted before promoted ones, least recently used first
+        for key in "abc":
+            self.cache.put(key, b"123")
+        self.assertEqual(b"123", self.cache.get("a")) #promoted
+        self.cache.put("d", b"123")
+        self.assertEqual(["c", "d", "a"], self.keys()) #b was the least recently used entry on probation
+        self.assertNotIn("b", self.cache)
+
+        self.cache.get("c") #protected segment exceeds its share ==> a is demoted to probation
+        self.assertEqual(["d", "a"], list(self.cache.probation))
+        self.assertEqual(["c"], list(self.cache.protected))
+        self.cache.put("e", b"123")
+        self.assertEqual(["a", "e", "c"], self.keys())
+        self.assertEqual(6, self.cache.probation_bytes)
+        self.assertEqual(3, self.cache.protected_bytes)
+
+    def test_oversize(self): #values larger than the whole budget must not be admitted and must not evict anything
+        self.cache.put("a", b"123")
+        self.cache.put("b", bytes(11))
+        self.assertEqual(["a"], self.keys())
+        self.cache.put("a", bytes(11)) #replacing an entry with an oversized value drops the old one
+        self.assertEqual([], self.keys())
+        self.assertEqual(0, self.cache.stats()["bytes"])
+        self.cache.put("c", bytes(10))
+        self.assertEqual(["c"], self.keys())
+
+    def test_stats(self): #hits, misses, evictions and the occupancy must be counted
+        self.cache.put("a", b"12")
+        self.cache.put("a", b"1234") #replacing resizes the entry
+        self.cache.get("a")
+        self.cache.get("a")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual("default", self.cache.get("b", "default"))
+        for key in "cdef":
+            self.cache.put(key, b"123")
+        stats = self.cache.stats()
+        self.assertEqual({"hits": 2, "misses": 2, "hit_rate": 0.5, "evictions": 2, "entries": 3, "bytes": 10, "max_bytes": 10}, stats)
+        self.assertEqual(3, len(self.cache))
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.stats()["bytes"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "pod"))
+
+import unittest
+import pickle
+import tempfile
+import numpy as np
+from utils import chunk_store, chunk_format, chunk_model, cell_index, manifest
+from chunk_fixtures import generate_chunk
+import chunk_format as pod_chunk_format
+
+
+class DefaultTestCase(unittest.TestCase):
+    #These tests run offline against a local directory store, no running server required
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = chunk_store.LocalChunkStore(self.directory.name)
+        self.path = chunk_store.chunk_path(5163466156970868736, 4)
+        os.makedirs(os.path.join(self.directory.name, os.path.dirname(self.path)))
+        with open(os.path.join(self.directory.name, self.path), "wb") as f:
+            f.write(b"chunk")
+        os.makedirs(os.path.join(self.directory.name, "metadata"))
+        with open(os.path.join(self.directory.name, "metadata", "4_A.pickle"), "wb") as f:
+            pickle.dump([1, 2, 3], f)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_layout(self): #same hashed layout as in the bucket
+        self.assertEqual("8a6ebd53b55aa610594d3d4bb3610cdc/3d/", self.path[:36])
+        self.assertTrue(self.path.endswith(".parquet"))
+
+    def test_read(self):
+        self.assertEqual(b"chunk", bytes(self.store.read(self.path)))
+        self.assertEqual([1, 2, 3], pickle.loads(self.store.read("metadata/4_A.pickle")))
+        with self.assertRaises(FileNotFoundError):
+            self.store.read(chunk_store.chunk_path(1, 4))
+
+    def test_list(self):
+        self.assertEqual(["metadata/4_A.pickle"], self.store.list("metadata"))
+        self.assertEqual([self.path], self.store.list(self.path.split("/")[0]))
+
+    def test_binary_format(self): #chunks written by the pod converter must map to the same model as the parquet chunks, sorted by altitude
+        df = generate_chunk(123, list(range(0, 360, 10)))
+        expected = chunk_model.from_df(df.sort_values("z", kind="stable"))
+        with open(os.path.join(self.directory.name, "chunk"), "wb") as f:
+            f.write(pod_chunk_format.chunk_to_bytes(df))
+        model = chunk_format.read_chunk(self.store.read("chunk"))
+        self.assertEqual(len(expected), len(model))
+        self.assertTrue(np.all(model.z[:-1] <= model.z[1:]))
+        for name in ["lat", "lon", "z", "means", "Psi"]:
+            np.testing.assert_array_equal(getattr(expected, name), getattr(model, name))
+        self.assertEqual(np.float16, model.Psi.dtype)
+        self.assertEqual(np.float32, chunk_format.read_chunk(pod_chunk_format.chunk_to_bytes(df, "float32")).Psi.dtype)
+        with self.assertRaises(ValueError):
+            chunk_format.read_chunk(b"PAR1" + bytes(100))
+
+    def test_truncated_binary_format(self): #the prefix of a chunk file must map to the top-k modes of the full model
+        df = generate_chunk(123, list(range(0, 360, 10))).sort_values("z", kind="stable")
+        expected = chunk_model.from_df(df)
+        data = pod_chunk_format.chunk_to_bytes(df)
+        prefix = data[:chunk_format.prefix_size(data[:chunk_format.HEADER_SIZE], 5)]
+        self.assertLess(len(prefix), len(data) / 4)
+        model = chunk_format.read_chunk(prefix, 5)
+        np.testing.assert_array_equal(expected.Psi[:, :5], model.Psi)
+        np.testing.assert_array_equal(expected.means, model.means)
+        with self.assertRaises(ValueError):
+            chunk_format.read_chunk(prefix)
+        np.testing.assert_array_equal(expected.Psi[:, :5], chunk_model.from_df(df[chunk_model.mode_columns(df.columns, 5)]).Psi)
+
+    def test_cell_index(self): #cells without a chunk must be filtered out, keeping the order of the others
+        cells = [5163466156970868736, 5163466141670047744, 2 ** 64 - 1, 3]
+        with open(os.path.join(self.directory.name, cell_index.index_path(4)), "wb") as f:
+            np.save(f, np.array([cells[1], cells[0]], dtype="uint64"))
+        index = cell_index.from_bytes(self.store.read(cell_index.index_path(4)))
+        self.assertEqual([True, True, False, False], list(cell_index.contains(index, cells)))
+        self.assertEqual(cells[:2], cell_index.filter_cells(index, cells))
+        self.assertEqual(cells, cell_index.filter_cells(None, cells))
+        self.assertEqual([], cell_index.filter_cells(index[:0], cells))
+
+    def test_manifest(self): #manifest from the bucket or from the file listing, with default file locations
+        with open(os.path.join(self.directory.name, manifest.manifest_path), "w") as f:
+            f.write('{"model_version": 3, "resolutions": {"4": {"chunks": 12, "A": "models/3/4_A.pickle"}}}')
+        parsed = manifest.from_bytes(self.store.read(manifest.manifest_path))
+        self.assertEqual("3", parsed.model_version)
+        self.assertEqual({"A": "models/3/4_A.pickle", "WDref": "metadata/4_WDref.pickle", "cells": "metadata/4_cells.npy"}, parsed.files(4))
+        self.assertEqual(12, parsed.to_dict()["resolutions"]["4"]["chunks"])
+        with self.assertRaises(ValueError):
+            manifest.from_bytes(b'{"resolutions": []}')
+        listed = manifest.from_listing("0", self.store.list("metadata"))
+        self.assertEqual([4], list(listed.resolutions.keys()))
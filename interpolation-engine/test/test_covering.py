@@ -198,3 +198,64 @@ class DefaultTestCase(unittest.TestCase):
         self.assertEqual(1.74, response["properties"]["sensor_data"]["ws"])
         self.assertEqual(287.5, response["properties"]["sensor_data"]["wd"])
 
+
+    def test_compact_formats(self): #compact formats must contain the same cells and sensor data as the GeoJSON response
+        example_json = {
+            "type": "Feature",
+            "geometry" : {
+                "type": "Polygon",
+                "coordinates": [ [
+                    [13.316, 52.515],
+                    [13.316, 52.512],
+                    [13.320, 52.512],
+                    [13.320, 52.515],
+                    [13.316, 52.515]
+                ] ]
+            },
+            "properties": {}
+        }
+        response = requests.post(f"{TARGET_URL}/covering", params={"resolution": 4}, json=example_json).json()
+        cells = [feature["properties"]["cell"] for feature in response["features"]]
+
+        ids = requests.post(f"{TARGET_URL}/covering", params={"resolution": 4, "format": "ids"}, json=example_json)
+        self.assertEqual(200, ids.status_code)
+        self.assertEqual(cells, ids.json()["cells"])
+        self.assertIn("sensor_data", ids.json()["properties"])
+
+        binary = requests.post(f"{TARGET_URL}/covering", params={"resolution": 4, "format": "binary"}, json=example_json)
+        self.assertEqual(200, binary.status_code)
+        self.assertEqual(8 * len(cells), len(binary.content))
+        self.assertEqual(cells, [str(int.from_bytes(binary.content[i:i + 8], "little")) for i in range(0, len(binary.content), 8)])
+        self.assertIn("wd", binary.headers["X-Sensor-Data"])
+
+    def test_adaptive_covering(self): #cells far from the camera must not be finer than the ones near it, and the budget must hold
+        example_json = {
+            "type": "Feature",
+            "geometry" : {
+                "type": "Polygon",
+                "coordinates": [ [
+                    [13.300, 52.500],
+                    [13.330, 52.500],
+                    [13.360, 52.530],
+                    [13.270, 52.530],
+                    [13.300, 52.500]
+                ] ]
+            },
+            "properties": {}
+        }
+        params = {"resolution": 1, "camera_lon": 13.315, "camera_lat": 52.499}
+        fixed = requests.post(f"{TARGET_URL}/covering", params={"resolution": 1, "format": "ids"}, json=example_json).json()
+        response = requests.post(f"{TARGET_URL}/covering", params=params, json=example_json)
+        self.assertEqual(200, response.status_code)
+        features = response.json()["features"]
+        self.assertLess(len(features), len(fixed["cells"]))
+        resolutions = [feature["properties"]["resolution"] for feature in features]
+        self.assertEqual(1, resolutions[0]) #nearest cells first
+        self.assertGreater(max(resolutions), 1)
+
+        ids = requests.post(f"{TARGET_URL}/covering", params={**params, "format": "ids", "max_cells": 50}, json=example_json).json()
+        self.assertLessEqual(len(ids["cells"]), 50)
+        self.assertEqual(len(ids["cells"]), len(ids["resolutions"]))
+
+        response = requests.post(f"{TARGET_URL}/covering", params={"resolution": 1, "camera_lon": 13.315}, json=example_json)
+        self.assertEqual(400, response.status_code)
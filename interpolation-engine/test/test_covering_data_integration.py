@@ -4,6 +4,7 @@ dotenv.load_dotenv("testenv.env")
 import unittest
 from io import BytesIO
 import pandas as pd
+import pyarrow as pa
 from shapely.geometry import Point, Polygon
 import requests
 from config import TARGET_URL
@@ -45,3 +46,28 @@ class DefaultTestCase(unittest.TestCase):
                 point = Point((row["lon"], row["lat"]))
                 self.assertTrue(feature_polygon.contains(point))
 
+
+    def test_progressive_stream(self): #the stream must send the cells of the coarse resolution before the ones of the covering
+        example_json = {
+            "type": "Feature",
+            "geometry" : {
+                "type": "Polygon",
+                "coordinates": [ [
+                    [13.316, 52.515],
+                    [13.316, 52.512],
+                    [13.320, 52.512],
+                    [13.320, 52.515],
+                    [13.316, 52.515]
+                ] ]
+            },
+            "properties": {}
+        }
+        resolution = 4
+        covering = requests.post(f"{TARGET_URL}/covering", params={"resolution": resolution, "format": "ids"}, json=example_json).json()
+        response = requests.post(f"{TARGET_URL}/stream/{resolution}/3d", params={"levels": 2}, json=example_json)
+        self.assertEqual(200, response.status_code)
+        self.assertIn("wd", response.headers["X-Sensor-Data"])
+        cells = [str(batch.column(0)[0].as_py()) for batch in pa.ipc.open_stream(response.content) if batch.num_rows > 0]
+        fine = [cell for cell in cells if cell in covering["cells"]]
+        self.assertEqual(fine, cells[len(cells) - len(fine):]) #fine cells last
+        self.assertLess(len(fine), len(cells))
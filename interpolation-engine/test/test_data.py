@@ -2,11 +2,39 @@ import dotenv
 dotenv.load_dotenv("testenv.env")
 from fastapi.testclient import TestClient
 import unittest
+import struct
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
 import requests
 from config import TARGET_URL
 
+
+def read_raw(content):
+    """
+    Decode a response in the raw columnar encoding (see utils.serializers.frames_to_raw) independently of the server code
+    :return: list with one dict from column name to numpy array per message
+    """
+    messages = []
+    offset = 0
+    while offset < len(content):
+        magic, version, n_columns, n_rows = struct.unpack_from("<4sBBxxI", content, offset)
+        assert (magic, version) == (b"WRAW", 1)
+        offset = offset + 12
+        descriptors = [struct.unpack_from("<6scB", content, offset + 8 * i) for i in range(n_columns)]
+        offset = offset + 8 * n_columns
+        offset = offset + (-offset % 8)
+        columns = {}
+        for name, kind, size in descriptors:
+            dtype = np.dtype(f"<{kind.decode()}{size}")
+            columns[name.rstrip(b"\0").decode()] = np.frombuffer(content, dtype=dtype, count=n_rows, offset=offset)
+            offset = offset + n_rows * size
+            offset = offset + (-offset % 8)
+        messages.append(columns)
+    return messages
+
 class DefaultTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -52,6 +80,134 @@ class DefaultTestCase(unittest.TestCase):
             self.assertLess(13, row["lon"])
             self.assertGreater(14, row["lon"])
 
+    def test_etag(self): #responses must carry an ETag that answers matching revalidations with 304 and no body
+        url = f"{TARGET_URL}/data/5163466156970868736/2/3d"
+        params = {"ws" : 1.1, "wd" : 110.1}
+        response = requests.get(url, params=params)
+        self.assertEqual(200, response.status_code)
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        for if_none_match in [etag, etag[2:], "*", f'"other", {etag}']:
+            response = requests.get(url, params=params, headers={"If-None-Match": if_none_match})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(b"", response.content)
+            self.assertEqual(etag, response.headers["ETag"])
+        response = requests.get(url, params=params, headers={"If-None-Match": '"other"'})
+        self.assertEqual(200, response.status_code)
+
+        for changed in [{"ws" : 1.2}, {"wd" : 110.2}, {"format" : "arrow"}]:
+            response = requests.get(url, params={**params, **changed})
+            self.assertEqual(200, response.status_code)
+            self.assertNotEqual(etag, response.headers["ETag"])
+
+    def test_encodings(self): #arrow and raw responses must hold the same data as parquet, in the documented layout
+        url = f"{TARGET_URL}/data/5163466156970868736/2/3d"
+        params = {"ws" : 1.1, "wd" : 110.1}
+        expected = pd.read_parquet(BytesIO(requests.get(url, params=params).content))
+
+        response = requests.get(url, params={**params, "format" : "arrow"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/vnd.apache.arrow.stream", response.headers["Content-Type"])
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(["lat", "lon", "z", "u", "v", "w"], table.column_names)
+        pd.testing.assert_frame_equal(expected, table.to_pandas())
+
+        response = requests.get(url, params={**params, "format" : "raw"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("application/x-wind-columns", response.headers["Content-Type"])
+        self.assertEqual(0, len(response.content) % 8)
+        messages = read_raw(response.content)
+        self.assertEqual(1, len(messages))
+        self.assertEqual(["lat", "lon", "z", "u", "v", "w"], list(messages[0].keys()))
+        for name, dtype in [("lat", "float32"), ("lon", "float32"), ("z", "int32"), ("u", "float32")]:
+            self.assertEqual(dtype, str(messages[0][name].dtype))
+            np.testing.assert_array_equal(expected[name].to_numpy(), messages[0][name])
+
+    def test_negotiation(self): #the Accept header selects the encoding, the format parameter takes precedence
+        url = f"{TARGET_URL}/data/5163466156970868736/2/3d"
+        params = {"ws" : 1.1, "wd" : 110.1}
+        for accept, media_type in [("application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.stream"),
+                                   ("text/html, application/x-wind-columns;q=0.9", "application/x-wind-columns"),
+                                   ("*/*", "application/vnd.apache.parquet"),
+                                   (None, "application/vnd.apache.parquet")]:
+            response = requests.get(url, params=params, headers={} if accept is None else {"Accept": accept})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(media_type, response.headers["Content-Type"])
+            self.assertIn("Accept", response.headers["Vary"])
+        response = requests.get(url, params={**params, "format" : "raw"}, headers={"Accept": "application/vnd.apache.arrow.stream"})
+        self.assertEqual("application/x-wind-columns", response.headers["Content-Type"])
+
+    def test_half_precision(self): #precision=16 must encode u, v and w as float16 and leave the coordinates as they are
+        url = f"{TARGET_URL}/data/5163466156970868736/2/3d"
+        params = {"ws" : 1.1, "wd" : 110.1}
+        expected = pd.read_parquet(BytesIO(requests.get(url, params=params).content))
+        table = pa.ipc.open_stream(requests.get(url, params={**params, "format" : "arrow", "precision" : 16}).content).read_all()
+        raw = read_raw(requests.get(url, params={**params, "format" : "raw", "precision" : 16}).content)[0]
+        for c in ["u", "v", "w"]:
+            self.assertEqual(pa.float16(), table.schema.field(c).type)
+            self.assertEqual("float16", str(raw[c].dtype))
+            np.testing.assert_array_equal(expected[c].to_numpy().astype("float16"), raw[c])
+        self.assertEqual("float32", str(raw["lat"].dtype))
+        response = requests.get(url, params={**params, "precision" : 8})
+        self.assertEqual(422, response.status_code)
+
+    def test_batch(self): #one row group per existing cell in the order of the request, with the data of the per-cell endpoint
+        cells = [5163466156970868736, 1, 5163466156433997824]
+        params = {"ws" : 1.1, "wd" : 110.1}
+        response = requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, "cells" : cells})
+        self.assertEqual(200, response.status_code)
+        file = pq.ParquetFile(BytesIO(response.content))
+        self.assertEqual(2, file.num_row_groups) #the non-existent cell is left out
+        for i, cell in enumerate([cells[0], cells[2]]):
+            df = file.read_row_group(i).to_pandas()
+            self.assertEqual(["cell", "lat", "lon", "z", "u", "v", "w"], list(df.columns))
+            self.assertEqual({cell}, set(int(c) for c in df["cell"]))
+            expected = pd.read_parquet(BytesIO(requests.get(f"{TARGET_URL}/data/{cell}/2/3d", params=params).content))
+            self.assertEqual(len(expected), len(df))
+            for c in ["lat", "lon", "z"]:
+                np.testing.assert_array_equal(expected[c].to_numpy(), df[c].to_numpy())
+            for c in ["u", "v", "w"]:
+                np.testing.assert_allclose(expected[c].to_numpy(), df[c].to_numpy(), rtol=1e-5, atol=1e-6)
+
+        raw = read_raw(requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, "cells" : cells, "format" : "raw"}).content)
+        self.assertEqual([cells[0], cells[2]], [int(message["cell"][0]) for message in raw])
+
+        response = requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, "cells" : list(range(1, 258))})
+        self.assertEqual(422, response.status_code) #more than max_batch_cells
+        response = requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, "cells" : list(range(1, 257))})
+        self.assertEqual(200, response.status_code)
+
+    def test_altitudes(self): #altitude (and max_altitude) must return exactly the datapoints of the whole chunk in that range
+        url = f"{TARGET_URL}/data/5163466156970868736/2/3d"
+        params = {"ws" : 1.1, "wd" : 110.1}
+        full = pd.read_parquet(BytesIO(requests.get(url, params=params).content))
+        altitudes = sorted(set(full["z"]))
+        self.assertLess(1, len(altitudes))
+        for low, high in [(altitudes[0], None), (altitudes[-1], None), (altitudes[0], altitudes[1]), (altitudes[0] - 0.5, altitudes[-1] + 0.5)]:
+            query = {**params, "altitude" : low} if high is None else {**params, "altitude" : low, "max_altitude" : high}
+            response = requests.get(url, params=query)
+            self.assertEqual(200, response.status_code)
+            df = pd.read_parquet(BytesIO(response.content))
+            expected = full[(full["z"] >= low) & (full["z"] <= (low if high is None else high))]
+            self.assertEqual(len(expected), len(df))
+            columns = ["lat", "lon", "z"]
+            df, expected = [frame.sort_values(columns).reset_index(drop=True) for frame in [df, expected]]
+            for c in columns:
+                np.testing.assert_array_equal(expected[c].to_numpy(), df[c].to_numpy())
+            for c in ["u", "v", "w"]:
+                np.testing.assert_allclose(expected[c].to_numpy(), df[c].to_numpy(), rtol=1e-5, atol=1e-6)
+
+        response = requests.get(url, params={**params, "altitude" : altitudes[-1] + 1000})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, len(pd.read_parquet(BytesIO(response.content))))
+        batch = requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, "cells" : [5163466156970868736], "altitude" : altitudes[0]})
+        self.assertEqual({altitudes[0]}, set(pd.read_parquet(BytesIO(batch.content))["z"]))
+
+        for invalid in [{"max_altitude" : altitudes[0]}, {"altitude" : altitudes[1], "max_altitude" : altitudes[0]}]:
+            self.assertEqual(422, requests.get(url, params={**params, **invalid}).status_code)
+            self.assertEqual(422, requests.get(f"{TARGET_URL}/data/batch/2/3d", params={**params, **invalid, "cells" : [1]}).status_code)
+
     @unittest.skip
     def test_2d(self): #CURRENTLY IGNORED AS WE DONT SUPPORT 2D VIEWS YET
         response = self.client.get("data", params= {"resolution" : 8, "cell" : "5163466156970868736", "ws" : 1.1, "wd" : 110.1, "altitude" : 35})
@@ -0,0 +1,133 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import unittest
+import numpy as np
+from utils import interpolation, chunk_model
+from utils.cache import SizedCache
+from chunk_fixtures import generate_chunk
+
+
+class DefaultTestCase(unittest.TestCase):
+    #These tests run offline against the interpolation code directly, no running server required
+
+    def setUp(self):
+        self.degs = list(range(0, 360, 10))
+        self.df = generate_chunk(500, self.degs)
+        rng = np.random.default_rng(1)
+        self.A = rng.normal(0, 10, (len(self.degs), len(self.degs)))
+        self.WDref = np.sort(rng.uniform(0, 360, len(self.degs)))
+
+    def test_precomputed_basis_equivalence(self): #precomputed basis must yield the same field as the POD product
+        model = chunk_model.from_df(self.df)
+        basis_model = chunk_model.precompute_basis(model, self.A)
+        #includes directions outside of the WDref range and directions that hit a reference direction exactly
+        for wd in [0.0, 0.5, self.WDref[0], self.WDref[3], 123.4, 287.5, 359.9]:
+            for ws in [0.3, 1.74, 12.0]:
+                df = self.df.copy()
+                interpolation.interpolate(df, self.A, self.WDref, wd, ws, compression_type="float32")
+                u, v, w = interpolation.interpolate_basis(basis_model, self.WDref, wd, ws, compression_type="float32")
+                scale = np.abs(df[["u", "v", "w"]].to_numpy()).max()
+                np.testing.assert_allclose(u, df["u"], rtol=0, atol=scale * 1e-5)
+                np.testing.assert_allclose(v, df["v"], rtol=0, atol=scale * 1e-5)
+                np.testing.assert_allclose(w, df["w"], rtol=0, atol=scale * 1e-5)
+
+    def test_direction_weights(self): #weights must reproduce np.interp for arbitrary coefficients
+        a = np.random.default_rng(2).normal(0, 1, len(self.WDref))
+        for wd in [0.0, 90.0, 180.5, 359.0]:
+            weights = interpolation.direction_weights(self.WDref, wd)
+            self.assertLessEqual(np.count_nonzero(weights), 2)
+            self.assertAlmostEqual(np.interp(wd, self.WDref, a), np.dot(weights, a))
+
+    def test_batch_equivalence(self): #stacked batch interpolation must yield the same fields as per-chunk interpolation
+        models = [chunk_model.from_df(generate_chunk(n, self.degs, seed=n)) for n in [10, 250, 37]]
+        AInterp = interpolation.interpolate_coefficients(self.A, self.WDref, 287.5)
+        for variant in [models, [chunk_model.to_float32(model) for model in models]]:
+            #a small stack limit splits the batch into several groups
+            for max_stack_bytes in [8 * 1024 * 1024, 30000]:
+                results = interpolation.interpolate_fused_models(variant, AInterp, 1.74, max_stack_bytes)
+                self.assertEqual(len(models), len(results))
+                for model, result in zip(models, results):
+                    expected = interpolation.interpolate_model(model, self.A, self.WDref, 287.5, 1.74, compression_type="float64")
+                    for component, expected_component in zip(result, expected):
+                        self.assertEqual(np.float32, component.dtype)
+                        self.assertEqual(len(model), len(component))
+                        np.testing.assert_allclose(component, expected_component, rtol=1e-5, atol=1e-5)
+
+    def test_scalable_result(self): #scaling the field at 1 m/s must yield the field interpolated at the wind speed
+        model = chunk_model.from_df(self.df)
+        result = interpolation.ScalableResult(*interpolation.interpolate_model(model, self.A, self.WDref, 123.4, 1.0, compression_type="float32"))
+        for ws, exact in [(1.74, False), (1.74, True), (12.0, False)]:
+            scaled, was_exact = result.scale(ws)
+            self.assertEqual(exact, was_exact)
+            expected = interpolation.interpolate_model(model, self.A, self.WDref, 123.4, ws, compression_type="float32")
+            for component, expected_component in zip(scaled, expected):
+                self.assertEqual(np.float32, component.dtype)
+                np.testing.assert_allclose(component, expected_component, rtol=1e-5, atol=1e-6)
+
+    def test_result_cache_bytes(self): #scaling cached results must not grow them beyond the byte budget of the cache
+        model = chunk_model.from_df(self.df)
+        size = interpolation.ScalableResult(*interpolation.interpolate_model(model, self.A, self.WDref, 0.0, 1.0, compression_type="float32")).nbytes
+        cache = SizedCache(3 * size, lambda result: result.nbytes)
+        for wd in range(0, 360, 30):
+            cache.put(wd, interpolation.ScalableResult(*interpolation.interpolate_model(model, self.A, self.WDref, wd, 1.0, compression_type="float32")))
+            for ws in [1.74, 5.0]:
+                for key in list(cache.probation) + list(cache.protected):
+                    cache.get(key).scale(ws)
+        results = [value for value, _ in list(cache.probation.values()) + list(cache.protected.values())]
+        #all arrays held by the results, directly or in tuples
+        arrays = [a for result in results for value in vars(result).values() for a in (value if isinstance(value, tuple) else [value])]
+        retained = sum(a.nbytes for a in arrays if isinstance(a, np.ndarray))
+        self.assertEqual(3, len(results))
+        self.assertLessEqual(retained, cache.max_bytes)
+        self.assertEqual(retained, cache.stats()["bytes"])
+
+    def test_fused_kernel(self): #fused float32 kernel must match the float64 product for float16 and float32 Psi
+        model = chunk_model.from_df(self.df)
+        self.assertTrue(model.Psi.T.flags.c_contiguous) #mode-major
+        AInterp = interpolation.interpolate_coefficients(self.A, self.WDref, 123.4)
+        expected = interpolation.interpolate_model(model, self.A, self.WDref, 123.4, 1.74, compression_type="float64")
+        for variant in [model, chunk_model.to_float32(model)]:
+            u, v, w, speed = interpolation.interpolate_fused(variant, AInterp, 1.74, magnitude=True)
+            for component, expected_component in zip([u, v, w], expected):
+                self.assertEqual(np.float32, component.dtype)
+                np.testing.assert_allclose(component, expected_component, rtol=1e-5, atol=1e-5)
+            np.testing.assert_allclose(speed, np.sqrt(sum(c.astype("float64") ** 2 for c in expected)), rtol=1e-5, atol=1e-5)
+
+    def test_truncated_modes(self): #top-k modes must match the POD product with a truncated Psi, and k must follow the budget
+        Psi, Sig, R = np.linalg.svd(np.random.default_rng(2).normal(0, 1, (60, len(self.degs))), full_matrices=False)
+        A = np.dot(np.diag(Sig), R)
+        energy = interpolation.mode_energy(A)
+        np.testing.assert_allclose(energy, Sig ** 2 / np.sum(Sig ** 2))
+        self.assertEqual(len(A), interpolation.modes_for_budget(energy, 0.0))
+        self.assertEqual(1, interpolation.modes_for_budget(energy, 1.0))
+        k = interpolation.modes_for_budget(energy, 0.2)
+        self.assertLessEqual(energy[k:].sum(), 0.2 + 1e-9)
+        self.assertGreater(energy[k - 1:].sum(), 0.2)
+        self.assertEqual({None: 0.001, 32: 0.01}, interpolation.parse_error_budgets("0.001,32:0.01"))
+
+        model = chunk_model.from_df(self.df)
+        truncated = chunk_model.ChunkModel(model.lat, model.lon, model.z, model.means, model.Psi[:, :k])
+        expected = interpolation.interpolate_model(truncated, self.A[:k], self.WDref, 123.4, 1.74, compression_type="float64")
+        AInterp = interpolation.interpolate_coefficients(self.A[:k], self.WDref, 123.4)
+        for component, expected_component in zip(interpolation.interpolate_fused(model, AInterp, 1.74), expected):
+            np.testing.assert_allclose(component, expected_component, rtol=1e-5, atol=1e-5)
+
+    def test_altitude_rows(self): #interpolating the rows of an altitude range must yield the same rows as the whole chunk
+        AInterp = interpolation.interpolate_coefficients(self.A, self.WDref, 123.4)
+        for df in [self.df, self.df.sort_values("z", kind="stable")]:
+            model = chunk_model.from_df(df)
+            rows = chunk_model.altitude_rows(model, 40, 50)
+            self.assertEqual(df is not self.df, isinstance(rows, slice)) #sorted chunks yield one block
+            np.testing.assert_array_equal(np.flatnonzero((model.z >= 40) & (model.z <= 50)), np.arange(len(model))[rows])
+            expected = interpolation.interpolate_fused(model, AInterp, 1.74)
+            for variant in [model, chunk_model.precompute_basis(model, self.A)]:
+                sliced = chunk_model.select_rows(variant, rows)
+                np.testing.assert_array_equal(model.z[rows], sliced.z)
+                if variant.basis is None:
+                    result = interpolation.interpolate_fused(sliced, AInterp, 1.74)
+                else:
+                    result = interpolation.interpolate_basis(sliced, self.WDref, 123.4, 1.74, compression_type="float32")
+                for component, expected_component in zip(result, expected):
+                    np.testing.assert_allclose(component, expected_component[rows], rtol=1e-5, atol=1e-5)
@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import unittest
+from models import InputPolygonFeature
+from utils import s2
+
+
+class DefaultTestCase(unittest.TestCase):
+    #These tests run offline against the covering code directly, no running server required (needs s2geometry)
+
+    def setUp(self):
+        self.poly = InputPolygonFeature.model_validate({
+            "type": "Feature",
+            "geometry" : {
+                "type": "Polygon",
+                "coordinates": [ [
+                    [13.300, 52.500],
+                    [13.330, 52.500],
+                    [13.360, 52.530],
+                    [13.270, 52.530],
+                    [13.300, 52.500]
+                ] ]
+            }
+        })
+        self.camera = (13.315, 52.499)
+
+    def test_adaptive_covering_gaps(self): #a pyramid with missing levels must only yield cells of its resolutions
+        pyramid = {1: None, 4: None, 16: None}
+        cells = s2.compute_adaptive_covering_ids(self.poly, 1, self.camera, pyramid)
+        resolutions = [resolution for _, resolution in cells]
+        self.assertLessEqual(set(resolutions), set(pyramid))
+        self.assertEqual(1, resolutions[0]) #nearest cells first
+        self.assertIn(4, resolutions) #resolution 2 is skipped, not used in place of 4
+        for cell, resolution in cells:
+            self.assertEqual(s2.resolution_to_cell_level[resolution], s2.s2g.S2CellId(cell).level())
+
+        #cells of the covering do not overlap
+        ranges = sorted(s2.index_to_query_range(cell) for cell, _ in cells)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertLessEqual(end, start)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import unittest
+import tempfile
+from sqlalchemy import create_engine, text
+from utils import sensor_ingest, shared_snapshot
+
+
+class DefaultTestCase(unittest.TestCase):
+    #These tests run offline against an in-memory SQLite stand-in for the sensor database
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.conn = self.engine.connect()
+        self.conn.execute(text("ATTACH DATABASE ':memory:' AS public"))
+        self.conn.execute(text('CREATE TABLE "public"."sensors-to-cloud-data" ("TIMESTAMP" TEXT, "EN_RAW_CV50_Wind_ms" REAL, '
+                               '"EN_RAW_CV50_WindDirection_deg" REAL, "ILR_RAW_CV50_Wind_ms" REAL, '
+                               '"ILR_RAW_CV50_WindDirection_deg" REAL, "EN_Temperature_C" REAL)'))
+        self.insert("2027-07-07 14:24:00", 1.74, 287.5)
+
+    def tearDown(self):
+        self.conn.close()
+        self.engine.dispose()
+
+    def insert(self, timestamp, ws, wd):
+        self.conn.execute(text('INSERT INTO "public"."sensors-to-cloud-data" VALUES (:t, :ws, :wd, 0.0, 0.0, 20.0)'),
+                          {"t": timestamp, "ws": ws, "wd": wd})
+
+    def test_full_table(self): #the original polling reads the first row and ignores the ILR sensor
+        reader = sensor_ingest.make_reader("poll")
+        self.assertEqual(("2027-07-07 14:24:00", {"EN": (1.74, 287.5)}), reader.read(self.conn))
+        self.assertEqual(("2027-07-07 14:24:00", {"EN": (1.74, 287.5)}), reader.read(self.conn))
+
+    def test_incremental(self): #only new rows are returned, newest first
+        reader = sensor_ingest.make_reader("incremental")
+        self.assertEqual(("2027-07-07 14:24:00", {"EN": (1.74, 287.5)}), reader.read(self.conn))
+        self.assertIsNone(reader.read(self.conn))
+        self.insert("2027-07-07 14:25:00", 2.0, 290.0)
+        self.insert("2027-07-07 14:26:00", 2.5, 300.0)
+        self.assertEqual(("2027-07-07 14:26:00", {"EN": (2.5, 300.0)}), reader.read(self.conn))
+        self.assertIsNone(reader.read(self.conn))
+        with self.assertRaises(ValueError):
+            sensor_ingest.make_reader("listen")
+
+    def test_shared_snapshot(self): #readings are shared between processes through a seqlock-guarded file
+        with tempfile.TemporaryDirectory() as directory:
+            writer = shared_snapshot.SharedSnapshot(os.path.join(directory, "snapshot"), size=64)
+            reader = shared_snapshot.SharedSnapshot(os.path.join(directory, "snapshot"), size=64)
+            self.assertEqual((0, None), reader.read())
+            writer.publish(b'{"EN": 1}')
+            self.assertEqual((2, b'{"EN": 1}'), reader.read())
+            writer.buffer[0] = 3 #writer died while writing
+            self.assertIsNone(reader.read(retries=3))
+            writer.publish(b"{}")
+            self.assertEqual((6, b"{}"), reader.read())
+            with self.assertRaises(ValueError):
+                writer.publish(bytes(64))
+
+            leader = shared_snapshot.LeaderLock(os.path.join(directory, "lock"))
+            follower = shared_snapshot.LeaderLock(os.path.join(directory, "lock"))
+            self.assertTrue(leader.try_acquire())
+            self.assertTrue(leader.try_acquire())
+            self.assertFalse(follower.try_acquire())
+            leader.file.close() #released like on the death of the leader
+            self.assertTrue(follower.try_acquire())
+
+    def test_leader_takeover(self): #a leader that keeps failing must hand over the lock to a follower
+        with tempfile.TemporaryDirectory() as directory:
+            leader = shared_snapshot.LeaderLock(os.path.join(directory, "lock"), max_failures=3)
+            follower = shared_snapshot.LeaderLock(os.path.join(directory, "lock"), max_failures=3)
+            self.assertTrue(leader.try_acquire())
+            self.assertFalse(leader.record(False))
+            self.assertFalse(leader.record(True)) #a successful round resets the count
+            self.assertFalse(leader.record(False))
+            self.assertFalse(leader.record(False))
+            self.assertFalse(follower.try_acquire())
+            self.assertTrue(leader.record(False))
+            self.assertIsNone(leader.file)
+            self.assertTrue(follower.try_acquire())
+            self.assertFalse(leader.try_acquire())
+            self.assertEqual(0, follower.failures)
@@ -0,0 +1,73 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import asyncio
+import unittest
+from utils.singleflight import SingleFlight
+
+
+class DefaultTestCase(unittest.IsolatedAsyncioTestCase):
+    #These tests run offline on the event loop of the test, no running server required
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def compute(self, value):
+        self.calls = self.calls + 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    async def test_shared_call(self): #concurrent waiters must share one computation and its result
+        waiters = [asyncio.ensure_future(self.flights.do("key", self.compute, 42)) for _ in range(5)]
+        await asyncio.sleep(0)
+        self.assertEqual({"in_flight": 1, "coalesced": 4}, self.flights.stats())
+        self.release.set()
+        self.assertEqual([42] * 5, await asyncio.gather(*waiters))
+        self.assertEqual(1, self.calls)
+        self.assertEqual(0, self.flights.stats()["in_flight"])
+
+    async def test_failure(self): #all waiters must get the same exception, and the failure must not be cached
+        error = ValueError("storage")
+        waiters = [asyncio.ensure_future(self.flights.do("key", self.compute, error)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        self.assertTrue(all(result is error for result in results))
+        self.assertEqual(0, self.flights.stats()["in_flight"])
+        self.assertEqual(7, await self.flights.do("key", self.compute, 7))
+        self.assertEqual(2, self.calls)
+
+    async def test_cancellation(self): #a cancelled waiter must not affect the others, the last one cancels the call
+        first = asyncio.ensure_future(self.flights.do("key", self.compute, 1))
+        second = asyncio.ensure_future(self.flights.do("key", self.compute, 1))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        self.assertTrue(first.cancelled())
+        self.assertFalse(self.cancelled)
+        self.release.set()
+        self.assertEqual(1, await second)
+
+        self.release.clear()
+        last = asyncio.ensure_future(self.flights.do("other", self.compute, 2))
+        await asyncio.sleep(0)
+        last.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await last
+        await asyncio.sleep(0)
+        self.assertTrue(self.cancelled)
+        self.assertEqual(0, self.flights.stats()["in_flight"])
+
+
+if __name__ == '__main__':
+    unittest.main()
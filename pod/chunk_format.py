@@ -0,0 +1,214 @@
+"""
+Writer for the binary chunk format that the interpolation engine maps directly into memory
+(reader: interpolation-engine/src/utils/chunk_format.py, keep both in sync)
+
+Layout (little-endian):
+    header      magic "WCHK", format version (uint16), float bits of means and Psi (uint16, 16 or 32),
+                number of datapoints N (uint32), number of POD modes M (uint32), zero-padded to 64 bytes
+    lat         float32[N]
+    lon         float32[N]
+    z           int32[N]
+    means       float[3N], stacked per wind component [u..., v..., w...]
+    Psi         float[M][3N], mode-major ==> every mode is one contiguous block
+
+Every section starts at a multiple of 64 bytes
+Rows are sorted by z ==> the rows of one altitude form one contiguous block in every section, which the engine finds
+with a binary search on the z section (the z section is the altitude index)
+
+Only binary chunks are sorted by altitude, parquet chunks keep the row order of model_generation.generate
+
+Also writes the cell index of a resolution (metadata/{resolution}_cells.npy, see cell_index_to_bytes), which the engine
+uses to skip cells without a chunk, and the model manifest (metadata/manifest.json, see manifest_to_bytes)
+
+Can also be run as a script to convert existing parquet chunks and write the cell indexes and the manifest for them:
+python chunk_format.py <directory with a local copy of the chunk bucket> [--model-version <version>]
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+import s2
+
+MAGIC = b"WCHK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+HEADER_SIZE = 64
+ALIGNMENT = 64
+#root folder of the chunks in the bucket, must be the same as in interpolation-engine/src/utils/chunk_store.py
+CHUNK_ROOT = "pre-calculation"
+RESOLUTIONS = [1, 2, 4, 8, 16, 32]
+
+
+def chunk_to_bytes(df, compression_type=None):
+    """
+    Encode the dataframe of a single chunk in the binary chunk format
+    :param df: dataframe with the rows of one chunk, as generated by model_generation.generate
+    :param compression_type: float type of means and Psi in the file ("float16" or "float32"),
+    defaults to the type of the interpolation parameters in df
+    :return: chunk file as bytes
+    """
+    df = sort_by_altitude(df)
+    u_columns = [col for col in df.columns if col.startswith("u_")]
+    v_columns = [col for col in df.columns if col.startswith("v_")]
+    w_columns = [col for col in df.columns if col.startswith("w_")]
+    if compression_type is None:
+        compression_type = "float16" if df[u_columns[0]].dtype == np.float16 else "float32"
+    float_type = np.dtype(compression_type).newbyteorder("<")
+    n_points, n_modes = len(df), len(u_columns)
+
+    #mode-major Psi: row i holds mode i for all u, then all v, then all w components
+    PsiT = np.concatenate([df[u_columns].to_numpy(dtype=float_type).T,
+                           df[v_columns].to_numpy(dtype=float_type).T,
+                           df[w_columns].to_numpy(dtype=float_type).T], axis=1)
+    means = np.concatenate([df["mean_u"].to_numpy(dtype=float_type),
+                            df["mean_v"].to_numpy(dtype=float_type),
+                            df["mean_w"].to_numpy(dtype=float_type)])
+    sections = [df["lat"].to_numpy(dtype="<f4"), df["lon"].to_numpy(dtype="<f4"), df["z"].to_numpy(dtype="<i4"),
+                means, np.ascontiguousarray(PsiT)]
+
+    parts = [HEADER.pack(MAGIC, VERSION, float_type.itemsize * 8, n_points, n_modes).ljust(HEADER_SIZE, b"\0")]
+    for array in sections:
+        data = array.tobytes()
+        parts.append(data + b"\0" * (-len(data) % ALIGNMENT))
+    return b"".join(parts)
+
+
+def sort_by_altitude(df):
+    """
+    Sort the rows of a chunk by altitude, keeping the order of the rows within each altitude
+    :return: sorted dataframe
+    """
+    return df.sort_values("z", kind="stable").reset_index(drop=True)
+
+
+def cell_index_to_bytes(cells):
+    """
+    Encode the index of the cells that have a chunk
+    Must be uploaded as metadata/{resolution}_cells.npy together with A and WDref of the resolution
+    :param cells: cell ids of all chunks of a resolution
+    :return: .npy file with the sorted unique cell ids as uint64
+    """
+    cells = np.unique(np.asarray(cells, dtype="uint64"))
+    buffer = io.BytesIO()
+    np.save(buffer, cells)
+    return buffer.getvalue()
+
+
+def manifest_to_bytes(model_version, chunk_counts, mode_energy=None, chunk_points=None):
+    """
+    Encode the model manifest (reader: interpolation-engine/src/utils/manifest.py)
+    Must be uploaded as metadata/manifest.json after all chunks and metadata files of the model, as the engine switches
+    to the new model version as soon as it sees the manifest
+    :param model_version: version of the model, must change with every rollout
+    :param chunk_counts: dict from resolution to the number of chunks of that resolution
+    :param mode_energy: optional dict from resolution to the energy of its POD modes (see model_generation.mode_energy)
+    :param chunk_points: optional dict from resolution to the mean number of datapoints per chunk,
+    used by the engine to keep distance-adaptive coverings within a point budget
+    :return: manifest file as bytes
+    """
+    resolutions = {str(resolution): {"chunks": int(chunks),
+                                     "A": f"metadata/{resolution}_A.pickle",
+                                     "WDref": f"metadata/{resolution}_WDref.pickle",
+                                     "cells": f"metadata/{resolution}_cells.npy"}
+                   for resolution, chunks in sorted(chunk_counts.items())}
+    for resolution, energy in (mode_energy or {}).items():
+        if str(resolution) in resolutions:
+            resolutions[str(resolution)]["energy"] = [float(e) for e in energy]
+    for resolution, points in (chunk_points or {}).items():
+        if str(resolution) in resolutions:
+            resolutions[str(resolution)]["points"] = int(round(points))
+    return json.dumps({"model_version": str(model_version), "resolutions": resolutions}, indent=4).encode()
+
+
+def resolution_folders():
+    """
+    Folder names of the resolutions in the hashed bucket layout (see chunk_path in interpolation-engine/src/utils/chunk_store.py)
+    :return: dict from folder name to resolution
+    """
+    return {hashlib.md5(f"{CHUNK_ROOT}/downsampling-factor-{resolution}".encode()).hexdigest(): resolution
+            for resolution in RESOLUTIONS}
+
+
+def chunk_cell(df, resolution, file_name):
+    """
+    Find the S2 cell of a chunk from its first datapoint, with the same cell level as model_generation.generate
+    The chunk file names are hashes of the cell ids ==> the cell is checked against the file name
+    :param df: dataframe of the chunk
+    :param resolution: resolution (downsampling factor) of the chunk
+    :param file_name: name of the chunk file in the bucket layout
+    :return: cell id
+    :raises ValueError: if the cell does not match the file name
+    """
+    cell = s2.encode_index(float(df["lat"].iloc[0]), float(df["lon"].iloc[0]), int(17 - math.log2(resolution)))
+    if hashlib.md5(f"{cell}".encode()).hexdigest() != file_name.split(".")[0]:
+        raise ValueError(f"Cell of chunk {file_name} not found")
+    return cell
+
+
+def convert_parquet_file(source, target, compression_type=None):
+    """
+    Convert a parquet chunk file to the binary chunk format
+    :param source: path of the parquet chunk
+    :param target: path of the binary chunk to write
+    :return: dataframe of the chunk
+    """
+    df = pd.read_parquet(source)
+    with open(target, "wb") as f:
+        f.write(chunk_to_bytes(df, compression_type))
+    return df
+
+
+def convert_directory(directory, compression_type=None, model_version=None):
+    """
+    Convert all parquet chunks in a local copy of the chunk bucket
+    The binary chunks are written next to the parquet chunks with the extension .chunk, so the hashed layout is kept
+    The cell index of every resolution is written to metadata/{resolution}_cells.npy, and with a model version also the
+    manifest to metadata/manifest.json
+    ==> upload the chunks and the metadata/*_cells.npy files first and metadata/manifest.json last, e.g.
+    gsutil -m rsync -r -x "metadata/manifest.json" <directory> gs://<bucket> && gsutil cp <directory>/metadata/manifest.json gs://<bucket>/metadata/
+    :param model_version: version of the model for the manifest, no manifest is written if not given
+    :return: number of converted chunks
+    """
+    folders = resolution_folders()
+    converted = 0
+    cells = {}
+    points = {}
+    for dir_path, _, files in os.walk(directory):
+        if os.path.basename(dir_path) != "3d":
+            continue
+        resolution = folders.get(os.path.basename(os.path.dirname(dir_path)))
+        for file in files:
+            if file.endswith(".parquet"):
+                source = os.path.join(dir_path, file)
+                df = convert_parquet_file(source, source[:-len(".parquet")] + ".chunk", compression_type)
+                converted = converted + 1
+                if resolution is not None:
+                    cells.setdefault(resolution, []).append(chunk_cell(df, resolution, file))
+                    points[resolution] = points.get(resolution, 0) + len(df)
+
+    os.makedirs(os.path.join(directory, "metadata"), exist_ok=True)
+    for resolution, resolution_cells in cells.items():
+        with open(os.path.join(directory, "metadata", f"{resolution}_cells.npy"), "wb") as f:
+            f.write(cell_index_to_bytes(resolution_cells))
+    if model_version is not None:
+        chunk_counts = {resolution: len(resolution_cells) for resolution, resolution_cells in cells.items()}
+        chunk_points = {resolution: points[resolution] / chunk_counts[resolution] for resolution in chunk_counts}
+        with open(os.path.join(directory, "metadata", "manifest.json"), "wb") as f:
+            f.write(manifest_to_bytes(model_version, chunk_counts, chunk_points=chunk_points))
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert parquet chunks to the binary chunk format and write the cell "
+                                                 "indexes and the manifest of the model")
+    parser.add_argument("directory", help="local copy of the chunk bucket")
+    parser.add_argument("--compression-type", choices=["float16", "float32"], default=None)
+    parser.add_argument("--model-version", default=None, help="version of the model, writes metadata/manifest.json if given")
+    args = parser.parse_args()
+    print(f"Converted {convert_directory(args.directory, args.compression_type, args.model_version)} chunks")
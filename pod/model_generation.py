@@ -20,7 +20,7 @@ bucket = storage_client.bucket(BUCKET_NAME)
 def generate(x_ref, y_ref, z_ref,
              utm_zone=33, compression_type="float16",
              downsampling_factor=1) \
-        -> (pd.DataFrame, bytes, bytes):
+        -> (pd.DataFrame, bytes, bytes, bytes):
     """
     This function will take in the raw data in the form of .npy tiles and create a model that can be used to interpolate
     for new wind directions. The model will be returned in a way that can be immediately uploaded to a SQL database, or stored as a file.
@@ -36,10 +36,11 @@ def generate(x_ref, y_ref, z_ref,
     :param downsampling_factor: specifies how much downsampling should be applied. Tiles will be aggregated to larger square tiles of
     downsampling_factor x downsampling_factor many sub-tiles. Should ideally a power of 2 (wasn't tested with anything else, so good luck if not),
     if =1, then no aggregation
-    :return: dataframe with coordinates (UTM + lat/lon), geohashes, and the interpolation parameters. Also, A and WDref encoded as bytestrings
+    :return: dataframe with coordinates (UTM + lat/lon), geohashes, and the interpolation parameters. Also, A, WDref and the
+    energy of the POD modes (see mode_energy) encoded as bytestrings
     """
     agg_vote_share = get_reasonable_share_value(downsampling_factor)
-    x_axis, y_axis, z_axis, Psi, means, A, WDref = pod_model(x_ref, y_ref, z_ref,
+    x_axis, y_axis, z_axis, Psi, means, A, WDref, energy = pod_model(x_ref, y_ref, z_ref,
                                                              compression_type=compression_type,
                                                              downsampling_factor=downsampling_factor,
                                                              agg_vote_share=agg_vote_share)
@@ -84,8 +85,8 @@ def generate(x_ref, y_ref, z_ref,
         df[f"w_{deg}"] = pd.Series(W[:, i])
 
     del U, V, W
-    #return the big dataframe, as well as binary encoding of the small helper-matrices A and WDref
-    return df, pickle.dumps(A), pickle.dumps(WDref)
+    #return the big dataframe, as well as binary encoding of the small helper-matrices A and WDref and the mode energies
+    return df, pickle.dumps(A), pickle.dumps(WDref), pickle.dumps(energy)
 
 
 def get_reasonable_share_value(downsampling_factor):
@@ -112,7 +113,7 @@ def pod_model(x_ref, y_ref, z_ref,
     Downsampling is also applied during this step
 
     Arguments are similar to generate() above, so refer to its documentation
-    :return: axis-arrays and interpolation parameters
+    :return: axis-arrays, interpolation parameters and the energy of the POD modes
     """
     #load UTM coordinates of datapoints
     x_axis = np.int32(np.load(download_file_bytes("x.npy")))
@@ -154,7 +155,19 @@ def pod_model(x_ref, y_ref, z_ref,
 
     Psi = Psi
     return x_axis.astype("int32"), y_axis.astype("int32"), z_axis.astype("int16"), Psi.astype(
-        compression_type), Xmean.astype(compression_type), A, WDref
+        compression_type), Xmean.astype(compression_type), A, WDref, mode_energy(Sig)
+
+
+def mode_energy(Sig):
+    """
+    Share of the total energy of the snapshots that each POD mode captures, from the singular values of the SVD
+    The modes are sorted by energy, so the engine can serve with only the first k modes and knows the error it makes
+    (see MODE_ERROR_BUDGET in the interpolation engine)
+    :param Sig: singular values, in the order of the modes
+    :return: numpy array with one energy share per mode, sums up to 1
+    """
+    energy = np.square(np.asarray(Sig, dtype="float64"))
+    return energy / energy.sum()
 
 
 def locate(x_axis, y_axis, z_axis, x_ref, y_ref, z_ref):